@@ -1,3 +1,8 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer
 from datetime import datetime, timedelta, timezone
@@ -32,6 +37,71 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+# bcrypt отпускает GIL, поэтому хватает пула потоков: event loop не блокируется
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Сколько операций может ждать пул; сверх лимита сразу отвечаем 503, а не копим очередь
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", str(PASSWORD_WORKERS * 16)))
+_password_executor: ThreadPoolExecutor | None = None
+_password_jobs = 0
+_password_jobs_lock = threading.Lock()  # счётчик уменьшается из потоков пула
+
+
+def _password_job_done(_future: Future | None = None) -> None:
+    global _password_jobs
+    with _password_jobs_lock:
+        _password_jobs -= 1
+
+
+def _get_password_executor() -> ThreadPoolExecutor:
+    global _password_executor
+    if _password_executor is None:
+        _password_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="bcrypt")
+    return _password_executor
+
+
+async def _run_password_job(func, *args):
+    global _password_jobs
+    with _password_jobs_lock:
+        if _password_jobs >= PASSWORD_QUEUE_LIMIT:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many authentication requests, try again later",
+                headers={"Retry-After": "1"},
+            )
+        _password_jobs += 1
+    try:
+        future = _get_password_executor().submit(func, *args)
+    except BaseException:
+        _password_job_done()
+        raise
+    # Место освобождается, когда задача действительно завершилась в пуле: отмена запроса
+    # (разрыв соединения, таймаут) не останавливает уже запущенный bcrypt
+    future.add_done_callback(_password_job_done)
+    return await asyncio.wrap_future(future)
+
+
+def shutdown_password_workers() -> None:
+    global _password_executor
+    if _password_executor is not None:
+        # Отменённые задачи тоже вызывают done callback, так что счётчик не «залипает»
+        _password_executor.shutdown(wait=False, cancel_futures=True)
+        _password_executor = None
+
+
+async def hash_password_async(password: str) -> str:
+    """
+    hash_password в ограниченном пуле потоков.
+    """
+    return await _run_password_job(hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """
+    verify_password в ограниченном пуле потоков.
+    """
+    return await _run_password_job(verify_password, plain_password, hashed_password)
+
+
 def create_access_token(data: dict):
     """
     Создаёт JWT с payload (sub, role, id, exp).
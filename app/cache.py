@@ -0,0 +1,248 @@
+import hashlib
+import itertools
+import json
+import logging
+import time
+from collections import OrderedDict
+from email.utils import formatdate
+from typing import Any, Hashable
+from uuid import uuid4
+
+from app.config import CACHE_URL
+
+logger = logging.getLogger("app.cache")
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Совпадает ли ETag с заголовком If-None-Match (слабое сравнение, список через запятую, *).
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class LRUCache:
+    """
+    Процессный LRU-кэш с ограничением по размеру и временем жизни записей.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class CacheBackend:
+    """
+    Общее для всех воркеров хранилище кэша (ключ -> байты с TTL).
+    """
+
+    async def get(self, key: str) -> bytes | None:
+        raise NotImplementedError
+
+    async def get_many(self, *keys: str) -> list[bytes | None]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        raise NotImplementedError
+
+    async def delete(self, *keys: str) -> None:
+        raise NotImplementedError
+
+
+class LocalCacheBackend(CacheBackend):
+    """
+    Локальная замена общего хранилища: для тестов и запуска в одном процессе.
+    """
+
+    def __init__(self, maxsize: int = 10_000):
+        self._cache = LRUCache(maxsize=maxsize)
+
+    async def get(self, key: str) -> bytes | None:
+        return self._cache.get(key)
+
+    async def get_many(self, *keys: str) -> list[bytes | None]:
+        return [self._cache.get(key) for key in keys]
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._cache.set(key, value, ttl=ttl)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._cache.pop(key)
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Общее хранилище в Redis (нужен пакет redis, подключается через CACHE_URL).
+    """
+
+    def __init__(self, url: str):
+        try:
+            from redis import asyncio as redis
+        except ImportError as ex:
+            raise RuntimeError("CACHE_URL is set, but the 'redis' package is not installed") from ex
+        self._client = redis.from_url(url)
+
+    async def get(self, key: str) -> bytes | None:
+        return await self._client.get(key)
+
+    async def get_many(self, *keys: str) -> list[bytes | None]:
+        return await self._client.mget(keys)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self._client.set(key, value, px=int(ttl * 1000))
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self._client.delete(*keys)
+
+
+def create_shared_backend(url: str | None) -> CacheBackend | None:
+    """
+    Выбирает общее хранилище по CACHE_URL: пусто — без него, local:// — локальная замена.
+    """
+    if not url:
+        return None
+    if url.startswith("local://"):
+        return LocalCacheBackend()
+    return RedisCacheBackend(url)
+
+
+class ProductCache:
+    """
+    Read-through кэш карточек товара: процессный LRU + необязательное общее хранилище.
+
+    Запись хранит готовое JSON-тело ответа, ETag и Last-Modified,
+    чтобы попадание в кэш не требовало ни запроса к БД, ни сериализации.
+
+    Против гонки cache-aside у каждой карточки есть поколение: invalidate его меняет,
+    а set не сохраняет запись, прочитанную из БД до смены поколения. Ошибки общего
+    хранилища не доходят до запросов: чтение идёт в БД, запись в кэш пропускается.
+    """
+
+    def __init__(self, shared: CacheBackend | None = None, ttl: float = 300.0, local_ttl: float | None = None):
+        self.shared = shared
+        self.ttl = ttl
+        # При общем хранилище локальная копия живёт недолго: так воркеры
+        # быстро видят инвалидацию, сделанную в другом процессе
+        if local_ttl is None:
+            local_ttl = 5.0 if shared is not None else ttl
+        self.local = LRUCache(maxsize=10_000, ttl=local_ttl)
+        self._generations = LRUCache(maxsize=100_000, ttl=2 * ttl)
+        self._counter = itertools.count(1)
+
+    @staticmethod
+    def _key(product_id: int) -> str:
+        return f"product:{product_id}"
+
+    @staticmethod
+    def _generation_key(product_id: int) -> str:
+        return f"product-gen:{product_id}"
+
+    @staticmethod
+    def make_entry(body: str) -> dict:
+        return {
+            "body": body,
+            "etag": f'"{hashlib.sha256(body.encode()).hexdigest()[:32]}"',
+            "last_modified": formatdate(usegmt=True),
+        }
+
+    async def get(self, product_id: int) -> dict | None:
+        key = self._key(product_id)
+        entry = self.local.get(key)
+        if entry is not None or self.shared is None:
+            return entry
+        try:
+            raw, generation = await self.shared.get_many(key, self._generation_key(product_id))
+        except Exception:
+            logger.warning("Shared cache is unavailable, reading product %d from the database", product_id,
+                           exc_info=True)
+            return None
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        if entry.pop("generation", None) != (generation.decode() if generation else None):
+            return None  # записана до инвалидации
+        self.local.set(key, entry)
+        return entry
+
+    async def generation(self, product_id: int) -> tuple | None:
+        """
+        Текущее поколение карточки: читается до запроса к БД и передаётся в set.
+        None — общее хранилище недоступно, кэшировать не нужно.
+        """
+        shared_generation = None
+        if self.shared is not None:
+            try:
+                raw = await self.shared.get(self._generation_key(product_id))
+            except Exception:
+                logger.warning("Shared cache is unavailable", exc_info=True)
+                return None
+            shared_generation = raw.decode() if raw else None
+        return self._generations.get(product_id), shared_generation
+
+    async def set(self, product_id: int, entry: dict, generation: tuple | None) -> None:
+        if generation is None:
+            return
+        local_generation, shared_generation = generation
+        if self._generations.get(product_id) != local_generation:
+            return  # карточку изменили, пока она читалась из БД
+        key = self._key(product_id)
+        self.local.set(key, entry)
+        if self.shared is not None:
+            try:
+                await self.shared.set(key, json.dumps({**entry, "generation": shared_generation}).encode(), self.ttl)
+            except Exception:
+                logger.warning("Failed to store product %d in the shared cache", product_id, exc_info=True)
+
+    async def invalidate(self, *product_ids: int) -> None:
+        """
+        Вызывается после коммита: ошибки общего хранилища только логируются.
+        """
+        keys = [self._key(product_id) for product_id in product_ids]
+        for product_id, key in zip(product_ids, keys):
+            self.local.pop(key)
+            self._generations.set(product_id, next(self._counter))
+        if self.shared is None or not keys:
+            return
+        try:
+            # Поколение живёт дольше любой записи, сделанной до его смены
+            for product_id in product_ids:
+                await self.shared.set(self._generation_key(product_id), uuid4().hex.encode(), 2 * self.ttl)
+            await self.shared.delete(*keys)
+        except Exception:
+            logger.exception("Failed to invalidate products %s in the shared cache", list(product_ids))
+
+
+shared_cache = create_shared_backend(CACHE_URL)
+product_cache = ProductCache(shared=shared_cache)
@@ -0,0 +1,472 @@
+import time
+from collections import OrderedDict
+
+CART_TTL = 30 * 24 * 3600   # сколько живёт уже записанная в БД корзина, сек
+
+# Позиции корзины: product_id -> (id позиции, количество)
+CartLines = dict[int, tuple[int, int]]
+
+
+class CartNotLoaded(Exception):
+    """
+    Корзины нет в хранилище: её нужно загрузить из cart_items и повторить операцию.
+    """
+
+
+class CheckoutInProgress(Exception):
+    """
+    Корзину уже оформляет другой запрос.
+    """
+
+
+class CartBackend:
+    """
+    Хранилище корзин для KeyValueCartStore.
+
+    Каждая операция атомарно меняет отдельные позиции, увеличивает версию корзины
+    и помечает её как ожидающую записи в БД. Набор таких корзин живёт в самом
+    хранилище, а не в памяти воркера, и они не вытесняются, пока не записаны.
+    """
+
+    async def load(self, user_id: int, lines: CartLines) -> None:
+        """Кладёт корзину, прочитанную из cart_items, если её ещё нет."""
+        raise NotImplementedError
+
+    async def get(self, user_id: int) -> CartLines:
+        raise NotImplementedError
+
+    async def add(self, user_id: int, product_id: int, quantity: int, line_id: int) -> tuple[int, int]:
+        """Прибавляет количество; line_id используется, если позиции ещё нет. Возвращает (id, количество)."""
+        raise NotImplementedError
+
+    async def set(self, user_id: int, product_id: int, quantity: int) -> tuple[int, int] | None:
+        """Задаёт количество существующей позиции; None — позиции нет."""
+        raise NotImplementedError
+
+    async def remove(self, user_id: int, product_id: int) -> bool:
+        raise NotImplementedError
+
+    async def clear(self, user_id: int) -> None:
+        raise NotImplementedError
+
+    async def apply(
+            self, user_id: int, actions: list[tuple[int, str, int, int]]
+    ) -> dict[int, int]:
+        """
+        Применяет (product_id, op, количество, id новой позиции) одной операцией.
+        Возвращает итоговые количества изменённых (не удалённых) позиций.
+        """
+        raise NotImplementedError
+
+    async def begin_checkout(self, user_id: int, token: str, lease: float) -> CartLines:
+        """Занимает корзину для оформления на lease секунд и возвращает её снимок."""
+        raise NotImplementedError
+
+    async def end_checkout(self, user_id: int, token: str) -> None:
+        raise NotImplementedError
+
+    async def consume(self, user_id: int, token: str, lines: list[tuple[int, int]]) -> None:
+        """Вычитает оплаченные количества и снимает занятость корзины."""
+        raise NotImplementedError
+
+    async def dirty_batch(self, size: int) -> list[int]:
+        raise NotImplementedError
+
+    async def read_for_flush(self, user_id: int) -> tuple[int, CartLines] | None:
+        """(версия, позиции) для записи в БД или None, если корзины нет."""
+        raise NotImplementedError
+
+    async def mark_clean(self, user_id: int, version: int | None, ttl: int) -> bool:
+        """Снимает пометку, если с момента чтения корзина не менялась; записанная корзина получает TTL."""
+        raise NotImplementedError
+
+    async def acquire_flush_lease(self, token: str, lease: float) -> bool:
+        """Только один воркер одновременно переносит корзины в БД."""
+        raise NotImplementedError
+
+    async def release_flush_lease(self, token: str) -> None:
+        raise NotImplementedError
+
+
+class LocalCartBackend(CartBackend):
+    """
+    Корзины в памяти процесса: для тестов и запуска в одном воркере.
+
+    Сверх maxsize вытесняются только давно не использованные корзины, уже записанные в БД.
+    """
+
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self._carts: OrderedDict[int, dict] = OrderedDict()
+        self._dirty: set[int] = set()
+
+    def _cart(self, user_id: int) -> dict:
+        cart = self._carts.get(user_id)
+        if cart is None:
+            raise CartNotLoaded
+        self._carts.move_to_end(user_id)
+        return cart
+
+    def _touch(self, user_id: int, cart: dict) -> None:
+        cart["version"] += 1
+        self._dirty.add(user_id)
+
+    def _evict(self) -> None:
+        excess = len(self._carts) - self.maxsize
+        for user_id in list(self._carts):
+            if excess <= 0:
+                break
+            if user_id in self._dirty or self._carts[user_id]["checkout"]:
+                continue
+            del self._carts[user_id]
+            excess -= 1
+
+    async def load(self, user_id: int, lines: CartLines) -> None:
+        if user_id not in self._carts:
+            self._carts[user_id] = {
+                "lines": {product_id: list(line) for product_id, line in lines.items()},
+                "version": 0,
+                "checkout": None,
+            }
+
+    async def get(self, user_id: int) -> CartLines:
+        return {product_id: tuple(line) for product_id, line in self._cart(user_id)["lines"].items()}
+
+    async def add(self, user_id: int, product_id: int, quantity: int, line_id: int) -> tuple[int, int]:
+        cart = self._cart(user_id)
+        line = cart["lines"].setdefault(product_id, [line_id, 0])
+        line[1] += quantity
+        self._touch(user_id, cart)
+        return line[0], line[1]
+
+    async def set(self, user_id: int, product_id: int, quantity: int) -> tuple[int, int] | None:
+        cart = self._cart(user_id)
+        line = cart["lines"].get(product_id)
+        if line is None:
+            return None
+        line[1] = quantity
+        self._touch(user_id, cart)
+        return line[0], line[1]
+
+    async def remove(self, user_id: int, product_id: int) -> bool:
+        cart = self._cart(user_id)
+        if cart["lines"].pop(product_id, None) is None:
+            return False
+        self._touch(user_id, cart)
+        return True
+
+    async def clear(self, user_id: int) -> None:
+        await self.load(user_id, {})
+        cart = self._cart(user_id)
+        cart["lines"].clear()
+        self._touch(user_id, cart)
+
+    async def apply(self, user_id: int, actions: list[tuple[int, str, int, int]]) -> dict[int, int]:
+        cart = self._cart(user_id)
+        result = {}
+        for product_id, op, quantity, line_id in actions:
+            if op == "remove":
+                cart["lines"].pop(product_id, None)
+                continue
+            line = cart["lines"].setdefault(product_id, [line_id, 0])
+            line[1] = line[1] + quantity if op == "add" else quantity
+            result[product_id] = line[1]
+        self._touch(user_id, cart)
+        return result
+
+    async def begin_checkout(self, user_id: int, token: str, lease: float) -> CartLines:
+        cart = self._cart(user_id)
+        if cart["checkout"] and cart["checkout"][1] > time.time():
+            raise CheckoutInProgress
+        cart["checkout"] = (token, time.time() + lease)
+        return await self.get(user_id)
+
+    async def end_checkout(self, user_id: int, token: str) -> None:
+        cart = self._carts.get(user_id)
+        if cart is not None and cart["checkout"] and cart["checkout"][0] == token:
+            cart["checkout"] = None
+
+    async def consume(self, user_id: int, token: str, lines: list[tuple[int, int]]) -> None:
+        cart = self._carts.get(user_id)
+        if cart is None:
+            return
+        for product_id, quantity in lines:
+            line = cart["lines"].get(product_id)
+            if line is None:
+                continue
+            line[1] -= quantity
+            if line[1] <= 0:
+                del cart["lines"][product_id]
+        await self.end_checkout(user_id, token)
+        self._touch(user_id, cart)
+
+    async def dirty_batch(self, size: int) -> list[int]:
+        return sorted(self._dirty)[:size]
+
+    async def read_for_flush(self, user_id: int) -> tuple[int, CartLines] | None:
+        cart = self._carts.get(user_id)
+        if cart is None:
+            return None
+        return cart["version"], {product_id: tuple(line) for product_id, line in cart["lines"].items()}
+
+    async def mark_clean(self, user_id: int, version: int | None, ttl: int) -> bool:
+        cart = self._carts.get(user_id)
+        if cart is not None and cart["version"] != version:
+            return False
+        self._dirty.discard(user_id)
+        self._evict()
+        return True
+
+    async def acquire_flush_lease(self, token: str, lease: float) -> bool:
+        return True
+
+    async def release_flush_lease(self, token: str) -> None:
+        pass
+
+
+# Скрипты Lua выполняются в Redis атомарно. Корзина — хеш cart:{user_id} с полями
+# q:{product_id} (количество), i:{product_id} (id позиции), _v (версия), _loaded,
+# _co/_co_until (кто и до какого момента оформляет заказ).
+_TOUCH = """
+redis.call('HINCRBY', KEYS[1], '_v', 1)
+redis.call('PERSIST', KEYS[1])
+redis.call('SADD', KEYS[2], ARGV[1])
+"""
+_REQUIRE_CART = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return false end
+"""
+
+_LOAD = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+redis.call('HSET', KEYS[1], '_loaded', 1, '_v', 0)
+for i = 2, #ARGV, 3 do
+  redis.call('HSET', KEYS[1], 'i:' .. ARGV[i], ARGV[i + 1], 'q:' .. ARGV[i], ARGV[i + 2])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+_ADD = _REQUIRE_CART + """
+local quantity = redis.call('HINCRBY', KEYS[1], 'q:' .. ARGV[2], ARGV[3])
+redis.call('HSETNX', KEYS[1], 'i:' .. ARGV[2], ARGV[4])
+local line_id = redis.call('HGET', KEYS[1], 'i:' .. ARGV[2])
+""" + _TOUCH + """
+return {tonumber(line_id), quantity}
+"""
+
+_SET = _REQUIRE_CART + """
+if redis.call('HEXISTS', KEYS[1], 'q:' .. ARGV[2]) == 0 then return {} end
+redis.call('HSET', KEYS[1], 'q:' .. ARGV[2], ARGV[3])
+local line_id = redis.call('HGET', KEYS[1], 'i:' .. ARGV[2])
+""" + _TOUCH + """
+return {tonumber(line_id), tonumber(ARGV[3])}
+"""
+
+_REMOVE = _REQUIRE_CART + """
+if redis.call('HDEL', KEYS[1], 'q:' .. ARGV[2], 'i:' .. ARGV[2]) == 0 then return 0 end
+""" + _TOUCH + """
+return 1
+"""
+
+_CLEAR = """
+local version = redis.call('HGET', KEYS[1], '_v') or '0'
+local checkout = redis.call('HMGET', KEYS[1], '_co', '_co_until')
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], '_loaded', 1, '_v', version)
+if checkout[1] then redis.call('HSET', KEYS[1], '_co', checkout[1], '_co_until', checkout[2]) end
+""" + _TOUCH + """
+return 1
+"""
+
+_APPLY = _REQUIRE_CART + """
+local result = {}
+for i = 2, #ARGV, 4 do
+  local product_id, op = ARGV[i], ARGV[i + 1]
+  if op == 'remove' then
+    redis.call('HDEL', KEYS[1], 'q:' .. product_id, 'i:' .. product_id)
+  else
+    local quantity
+    if op == 'add' then
+      quantity = redis.call('HINCRBY', KEYS[1], 'q:' .. product_id, ARGV[i + 2])
+    else
+      redis.call('HSET', KEYS[1], 'q:' .. product_id, ARGV[i + 2])
+      quantity = tonumber(ARGV[i + 2])
+    end
+    redis.call('HSETNX', KEYS[1], 'i:' .. product_id, ARGV[i + 3])
+    table.insert(result, tonumber(product_id))
+    table.insert(result, quantity)
+  end
+end
+""" + _TOUCH + """
+return result
+"""
+
+_BEGIN_CHECKOUT = _REQUIRE_CART + """
+if tonumber(redis.call('HGET', KEYS[1], '_co_until') or '0') > tonumber(ARGV[2]) then return {0} end
+redis.call('HSET', KEYS[1], '_co', ARGV[1], '_co_until', tonumber(ARGV[2]) + tonumber(ARGV[3]))
+local result = {1}
+for _, value in ipairs(redis.call('HGETALL', KEYS[1])) do table.insert(result, value) end
+return result
+"""
+
+_END_CHECKOUT = """
+if redis.call('HGET', KEYS[1], '_co') == ARGV[1] then redis.call('HDEL', KEYS[1], '_co', '_co_until') end
+return 1
+"""
+
+_CONSUME = _REQUIRE_CART + """
+for i = 3, #ARGV, 2 do
+  local field = 'q:' .. ARGV[i]
+  if redis.call('HEXISTS', KEYS[1], field) == 1 then
+    if redis.call('HINCRBY', KEYS[1], field, -tonumber(ARGV[i + 1])) <= 0 then
+      redis.call('HDEL', KEYS[1], field, 'i:' .. ARGV[i])
+    end
+  end
+end
+if redis.call('HGET', KEYS[1], '_co') == ARGV[2] then redis.call('HDEL', KEYS[1], '_co', '_co_until') end
+""" + _TOUCH + """
+return 1
+"""
+
+_MARK_CLEAN = """
+local version = redis.call('HGET', KEYS[1], '_v')
+if version and version ~= ARGV[2] then return 0 end
+redis.call('SREM', KEYS[2], ARGV[1])
+if version then redis.call('EXPIRE', KEYS[1], ARGV[3]) end
+return 1
+"""
+
+_RELEASE_LEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+def _parse_cart(fields: list | dict) -> tuple[int, CartLines]:
+    if isinstance(fields, list):
+        fields = dict(zip(fields[::2], fields[1::2]))
+    version, ids, quantities = 0, {}, {}
+    for raw_name, value in fields.items():
+        name = raw_name.decode() if isinstance(raw_name, bytes) else raw_name
+        if name == "_v":
+            version = int(value)
+        elif name.startswith("q:"):
+            quantities[int(name[2:])] = int(value)
+        elif name.startswith("i:"):
+            ids[int(name[2:])] = int(value)
+    return version, {product_id: (ids[product_id], quantity) for product_id, quantity in quantities.items()}
+
+
+class RedisCartBackend(CartBackend):
+    """
+    Корзины в Redis (нужен пакет redis). Каждая операция — один скрипт Lua,
+    поэтому одновременные правки одной корзины из разных воркеров не теряются.
+
+    Корзины, ожидающие записи в БД, хранятся без TTL и перечислены в множестве cart:dirty.
+    Для хранилища корзин лучше отдельный Redis с maxmemory-policy noeviction или volatile-*:
+    тогда вытеснены могут быть только уже записанные корзины.
+    """
+
+    DIRTY_KEY = "cart:dirty"
+    FLUSH_LEASE_KEY = "cart:flush-lease"
+
+    def __init__(self, url: str):
+        try:
+            from redis import asyncio as redis
+        except ImportError as ex:
+            raise RuntimeError("CART_STORE_URL is set, but the 'redis' package is not installed") from ex
+        self._client = redis.from_url(url)
+        self._scripts = {
+            name: self._client.register_script(source)
+            for name, source in {
+                "load": _LOAD, "add": _ADD, "set": _SET, "remove": _REMOVE, "clear": _CLEAR,
+                "apply": _APPLY, "begin_checkout": _BEGIN_CHECKOUT, "end_checkout": _END_CHECKOUT,
+                "consume": _CONSUME, "mark_clean": _MARK_CLEAN, "release_lease": _RELEASE_LEASE,
+            }.items()
+        }
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"cart:{user_id}"
+
+    async def _run(self, name: str, user_id: int, *args):
+        return await self._scripts[name](keys=[self._key(user_id), self.DIRTY_KEY], args=[user_id, *args])
+
+    async def load(self, user_id: int, lines: CartLines) -> None:
+        args = [value for product_id, (line_id, quantity) in lines.items() for value in (product_id, line_id, quantity)]
+        await self._scripts["load"](keys=[self._key(user_id)], args=[CART_TTL, *args])
+
+    async def get(self, user_id: int) -> CartLines:
+        fields = await self._client.hgetall(self._key(user_id))
+        if not fields:
+            raise CartNotLoaded
+        return _parse_cart(fields)[1]
+
+    async def add(self, user_id: int, product_id: int, quantity: int, line_id: int) -> tuple[int, int]:
+        result = await self._run("add", user_id, product_id, quantity, line_id)
+        if result is None:
+            raise CartNotLoaded
+        return result[0], result[1]
+
+    async def set(self, user_id: int, product_id: int, quantity: int) -> tuple[int, int] | None:
+        result = await self._run("set", user_id, product_id, quantity)
+        if result is None:
+            raise CartNotLoaded
+        return (result[0], result[1]) if result else None
+
+    async def remove(self, user_id: int, product_id: int) -> bool:
+        result = await self._run("remove", user_id, product_id)
+        if result is None:
+            raise CartNotLoaded
+        return bool(result)
+
+    async def clear(self, user_id: int) -> None:
+        await self._run("clear", user_id)
+
+    async def apply(self, user_id: int, actions: list[tuple[int, str, int, int]]) -> dict[int, int]:
+        result = await self._run("apply", user_id, *(value for action in actions for value in action))
+        if result is None:
+            raise CartNotLoaded
+        return dict(zip(result[::2], result[1::2]))
+
+    async def begin_checkout(self, user_id: int, token: str, lease: float) -> CartLines:
+        now_ms = int(time.time() * 1000)
+        result = await self._scripts["begin_checkout"](
+            keys=[self._key(user_id)], args=[token, now_ms, int(lease * 1000)]
+        )
+        if result is None:
+            raise CartNotLoaded
+        if result[0] == 0:
+            raise CheckoutInProgress
+        return _parse_cart(result[1:])[1]
+
+    async def end_checkout(self, user_id: int, token: str) -> None:
+        await self._scripts["end_checkout"](keys=[self._key(user_id)], args=[token])
+
+    async def consume(self, user_id: int, token: str, lines: list[tuple[int, int]]) -> None:
+        await self._run("consume", user_id, token, *(value for line in lines for value in line))
+
+    async def dirty_batch(self, size: int) -> list[int]:
+        return [int(user_id) for user_id in await self._client.srandmember(self.DIRTY_KEY, size)]
+
+    async def read_for_flush(self, user_id: int) -> tuple[int, CartLines] | None:
+        fields = await self._client.hgetall(self._key(user_id))
+        return _parse_cart(fields) if fields else None
+
+    async def mark_clean(self, user_id: int, version: int | None, ttl: int) -> bool:
+        return bool(await self._run("mark_clean", user_id, "" if version is None else version, ttl))
+
+    async def acquire_flush_lease(self, token: str, lease: float) -> bool:
+        return bool(await self._client.set(self.FLUSH_LEASE_KEY, token, nx=True, px=int(lease * 1000)))
+
+    async def release_flush_lease(self, token: str) -> None:
+        await self._scripts["release_lease"](keys=[self.FLUSH_LEASE_KEY], args=[token])
+
+
+def create_cart_backend(url: str | None) -> CartBackend:
+    """
+    Хранилище для CART_STORE=kv: redis://... или, если адрес пуст либо local://, память процесса.
+    """
+    if not url or url.startswith("local://"):
+        return LocalCartBackend()
+    return RedisCartBackend(url)
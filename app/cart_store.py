@@ -0,0 +1,551 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from decimal import Decimal
+from typing import NamedTuple
+from uuid import uuid4
+
+from fastapi import HTTPException, status
+from sqlalchemy import Integer, Sequence, column, delete, func, literal, select, union_all, update, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager
+
+from app.cart_backends import (
+    CART_TTL, CartBackend, CartLines, CartNotLoaded, CheckoutInProgress, create_cart_backend,
+)
+from app.config import CART_STORE, CART_STORE_URL
+from app.database import async_session_maker
+from app.models.cart_items import CartItem as CartItemModel
+from app.models.products import Product as ProductModel
+from app.schemas import Cart as CartSchema, CartItem as CartItemSchema, CartSummary
+
+logger = logging.getLogger("app.cart_store")
+
+CART_ITEM_ID_SEQ = Sequence("cart_items_id_seq")
+
+# Итоговое действие над позицией: ("add", n), ("set", n) или ("remove", None)
+CartActions = dict[int, tuple[str, int | None]]
+# Вызывается с итоговыми количествами изменённых позиций {product_id: количество} до фиксации
+# изменения; исключение отменяет изменение (так резервируются остатки)
+ReserveHook = Callable[[dict[int, int]], Awaitable[None]]
+
+
+class CartLine(NamedTuple):
+    product_id: int
+    quantity: int
+
+
+class CartSnapshot(NamedTuple):
+    lines: list[CartLine]
+    token: str | None = None  # чем занята корзина на время оформления (если хранилище это поддерживает)
+
+
+def _line_total(quantity, price):
+    return quantity * func.coalesce(price, 0)
+
+
+def _not_found(detail: str = "Cart item not found") -> HTTPException:
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=detail)
+
+
+def _missing_products(requested, available) -> HTTPException | None:
+    missing = sorted(set(requested) - set(available))
+    if not missing:
+        return None
+    return _not_found(f"Products not found or inactive: {', '.join(map(str, missing))}")
+
+
+class CartStore:
+    """
+    Хранилище корзин, через которое работает роутер /cart и оформление заказа.
+
+    Методы, меняющие корзину, сами завершают транзакцию. Хранилище kv не пишет в БД
+    при правках корзины — транзакцию с резервами фиксирует вызывающий.
+    """
+
+    write_behind = False
+
+    async def get_cart(self, db: AsyncSession, user_id: int) -> CartSchema:
+        raise NotImplementedError
+
+    async def get_summary(self, db: AsyncSession, user_id: int) -> CartSummary:
+        raise NotImplementedError
+
+    async def add_item(
+            self, db: AsyncSession, user_id: int, product_id: int, quantity: int, reserve: ReserveHook | None = None
+    ) -> CartItemSchema:
+        raise NotImplementedError
+
+    async def set_quantity(
+            self, db: AsyncSession, user_id: int, product_id: int, quantity: int, reserve: ReserveHook | None = None
+    ) -> CartItemSchema:
+        raise NotImplementedError
+
+    async def remove_item(self, db: AsyncSession, user_id: int, product_id: int) -> None:
+        raise NotImplementedError
+
+    async def clear(self, db: AsyncSession, user_id: int) -> None:
+        raise NotImplementedError
+
+    async def apply(
+            self, db: AsyncSession, user_id: int, actions: CartActions, reserve: ReserveHook | None = None
+    ) -> None:
+        raise NotImplementedError
+
+    async def snapshot(self, db: AsyncSession, user_id: int) -> CartSnapshot:
+        """
+        Согласованный снимок корзины для оформления заказа, позиции по возрастанию product_id.
+        """
+        raise NotImplementedError
+
+    async def release(self, user_id: int, snapshot: CartSnapshot) -> None:
+        """
+        Освобождает корзину, если заказ не оформлен.
+        """
+
+    async def consume(self, user_id: int, snapshot: CartSnapshot) -> None:
+        """
+        Убирает из корзины оплаченные позиции после фиксации заказа.
+        """
+
+    async def flush(self) -> None:
+        """
+        Сбрасывает отложенные изменения в cart_items.
+        """
+
+
+class SqlCartStore(CartStore):
+    """
+    Корзины прямо в таблице cart_items: каждое изменение — отдельная транзакция.
+    """
+
+    @staticmethod
+    async def _fetch_changed_item(db: AsyncSession, changed) -> CartItemSchema | None:
+        """
+        Выполняет изменяющий CTE (RETURNING id, product_id, quantity) вместе с выборкой товара.
+        """
+        result = await db.execute(
+            select(changed.c.id.label("line_id"), changed.c.quantity, ProductModel)
+            .select_from(changed)
+            .join(ProductModel, ProductModel.id == changed.c.product_id)
+        )
+        row = result.first()
+        if row is None:
+            return None
+        return CartItemSchema(id=row.line_id, quantity=row.quantity, product=row.Product)
+
+    async def get_cart(self, db: AsyncSession, user_id: int) -> CartSchema:
+        # Позиции, товары и итоги одним запросом: суммы считает БД оконными функциями
+        result = await db.execute(
+            select(
+                CartItemModel,
+                func.sum(CartItemModel.quantity).over().label("total_quantity"),
+                func.sum(_line_total(CartItemModel.quantity, ProductModel.price)).over().label("total_price"),
+            )
+            .join(CartItemModel.product)
+            .options(contains_eager(CartItemModel.product))
+            .where(CartItemModel.user_id == user_id)
+            .order_by(CartItemModel.id)
+        )
+        rows = result.all()
+
+        return CartSchema(
+            user_id=user_id,
+            items=[row.CartItem for row in rows],
+            total_quantity=rows[0].total_quantity if rows else 0,
+            total_price=rows[0].total_price if rows else Decimal("0"),
+        )
+
+    async def get_summary(self, db: AsyncSession, user_id: int) -> CartSummary:
+        result = await db.execute(
+            select(
+                func.count(CartItemModel.id).label("items_count"),
+                func.coalesce(func.sum(CartItemModel.quantity), 0).label("total_quantity"),
+                func.coalesce(func.sum(_line_total(CartItemModel.quantity, ProductModel.price)), 0)
+                .label("total_price"),
+            )
+            .join(ProductModel, ProductModel.id == CartItemModel.product_id)
+            .where(CartItemModel.user_id == user_id)
+        )
+        return CartSummary.model_validate(result.one()._asdict())
+
+    async def add_item(
+            self, db: AsyncSession, user_id: int, product_id: int, quantity: int, reserve: ReserveHook | None = None
+    ) -> CartItemSchema:
+        # Одно выражение: проверка товара, вставка или увеличение количества и выборка товара
+        stmt = insert(CartItemModel).from_select(
+            ["user_id", "product_id", "quantity"],
+            select(literal(user_id), ProductModel.id, literal(quantity))
+            .where(ProductModel.id == product_id, ProductModel.is_active == True),
+        )
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_cart_items_user_product",
+            set_={"quantity": CartItemModel.quantity + stmt.excluded.quantity, "updated_at": func.now()},
+        )
+        cart_item = await self._fetch_changed_item(
+            db, stmt.returning(CartItemModel.id, CartItemModel.product_id, CartItemModel.quantity).cte("changed")
+        )
+        if cart_item is None:
+            raise _not_found("Product not found or inactive")
+        if reserve is not None:
+            await reserve({product_id: cart_item.quantity})
+        await db.commit()
+        return cart_item
+
+    async def set_quantity(
+            self, db: AsyncSession, user_id: int, product_id: int, quantity: int, reserve: ReserveHook | None = None
+    ) -> CartItemSchema:
+        stmt = (
+            update(CartItemModel)
+            .where(
+                CartItemModel.user_id == user_id,
+                CartItemModel.product_id == product_id,
+                select(ProductModel.id)
+                .where(ProductModel.id == product_id, ProductModel.is_active == True)
+                .exists(),
+            )
+            .values(quantity=quantity)
+            .returning(CartItemModel.id, CartItemModel.product_id, CartItemModel.quantity)
+        )
+        cart_item = await self._fetch_changed_item(db, stmt.cte("changed"))
+        if cart_item is None:
+            # Дополнительный запрос только на пути ошибки — чтобы вернуть прежний текст
+            available = await db.scalar(
+                select(ProductModel.id).where(ProductModel.id == product_id, ProductModel.is_active == True)
+            )
+            raise _not_found() if available is not None else _not_found("Product not found or inactive")
+        if reserve is not None:
+            await reserve({product_id: cart_item.quantity})
+        await db.commit()
+        return cart_item
+
+    async def remove_item(self, db: AsyncSession, user_id: int, product_id: int) -> None:
+        removed = await db.scalar(
+            delete(CartItemModel)
+            .where(CartItemModel.user_id == user_id, CartItemModel.product_id == product_id)
+            .returning(CartItemModel.id)
+        )
+        if removed is None:
+            raise _not_found()
+        await db.commit()
+
+    async def clear(self, db: AsyncSession, user_id: int) -> None:
+        await db.execute(delete(CartItemModel).where(CartItemModel.user_id == user_id))
+        await db.commit()
+
+    async def apply(
+            self, db: AsyncSession, user_id: int, actions: CartActions, reserve: ReserveHook | None = None
+    ) -> None:
+        upserts = {product_id: action for product_id, action in actions.items() if action[0] != "remove"}
+        removed_ids = [product_id for product_id, action in actions.items() if action[0] == "remove"]
+
+        if upserts:
+            available = (await db.scalars(
+                select(ProductModel.id).where(ProductModel.id.in_(list(upserts)), ProductModel.is_active == True)
+            )).all()
+            if error := _missing_products(upserts, available):
+                raise error
+
+        remove_stmt = delete(CartItemModel).where(
+            CartItemModel.user_id == user_id,
+            CartItemModel.product_id.in_(removed_ids),
+        )
+        if upserts:
+            # add и set — отдельные upsert-CTE: add увеличивает количество в самом ON CONFLICT,
+            # как add_item, поэтому параллельные добавления не теряются
+            groups: dict[str, list[tuple[int, int]]] = {"add": [], "set": []}
+            for product_id, (op, quantity) in upserts.items():
+                groups[op].append((product_id, quantity))
+            changed = [self._upsert_lines(user_id, op, rows).cte(f"{op}_lines") for op, rows in groups.items() if rows]
+            stmt = union_all(*(select(cte.c.product_id, cte.c.quantity) for cte in changed))
+            if removed_ids:
+                stmt = stmt.add_cte(remove_stmt.cte("removed"))
+            result = await db.execute(stmt)
+            if reserve is not None:
+                await reserve(dict(result.tuples().all()))
+        else:
+            await db.execute(remove_stmt)
+        await db.commit()
+
+    @staticmethod
+    def _upsert_lines(user_id: int, op: str, rows: list[tuple[int, int]]):
+        requested = values(
+            column("product_id", Integer), column("quantity", Integer), name=f"requested_{op}"
+        ).data(rows)
+        stmt = insert(CartItemModel).from_select(
+            ["user_id", "product_id", "quantity"],
+            select(literal(user_id), requested.c.product_id, requested.c.quantity).select_from(requested),
+        )
+        quantity = CartItemModel.quantity + stmt.excluded.quantity if op == "add" else stmt.excluded.quantity
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_cart_items_user_product",
+            set_={"quantity": quantity, "updated_at": func.now()},
+        )
+        return stmt.returning(CartItemModel.product_id, CartItemModel.quantity)
+
+    async def snapshot(self, db: AsyncSession, user_id: int) -> CartSnapshot:
+        # Строки корзины блокируются до конца транзакции заказа: параллельный checkout
+        # той же корзины ждёт и после фиксации первого видит её уже пустой
+        result = await db.execute(
+            select(CartItemModel.product_id, CartItemModel.quantity)
+            .where(CartItemModel.user_id == user_id)
+            .order_by(CartItemModel.product_id)
+            .with_for_update()
+        )
+        return CartSnapshot([CartLine(row.product_id, row.quantity) for row in result.all()])
+
+
+class KeyValueCartStore(CartStore):
+    """
+    Корзины в хранилище ключ-значение (Redis или память процесса) с отложенной записью в БД.
+
+    Каждая правка атомарно меняет отдельные позиции корзины в хранилище (см. app.cart_backends),
+    так что одновременные запросы из разных воркеров не теряют изменений. Изменённые корзины
+    помечаются в самом хранилище и пачками переносятся в cart_items фоновой задачей; до записи
+    они не вытесняются. При промахе корзина читается из cart_items. id позиции берётся из
+    последовательности cart_items_id_seq, поэтому ответы API не отличаются от SQL-хранилища.
+    """
+
+    write_behind = True
+    CHECKOUT_LEASE = 60.0
+    FLUSH_LEASE = 60.0
+
+    def __init__(self, backend: CartBackend, flush_interval: float = 2.0, batch_size: int = 500):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+    async def _call(self, db: AsyncSession, user_id: int, operation, *args):
+        """
+        Выполняет операцию хранилища; если корзины там нет, загружает её из cart_items и повторяет.
+        """
+        try:
+            return await operation(user_id, *args)
+        except CartNotLoaded:
+            result = await db.execute(
+                select(CartItemModel.product_id, CartItemModel.id, CartItemModel.quantity)
+                .where(CartItemModel.user_id == user_id)
+            )
+            await self.backend.load(user_id, {row.product_id: (row.id, row.quantity) for row in result.all()})
+            return await operation(user_id, *args)
+
+    @staticmethod
+    def _lines_values(lines: CartLines):
+        return values(
+            column("id", Integer), column("product_id", Integer), column("quantity", Integer), name="lines"
+        ).data([(line_id, product_id, quantity) for product_id, (line_id, quantity) in lines.items()])
+
+    async def get_cart(self, db: AsyncSession, user_id: int) -> CartSchema:
+        lines = await self._call(db, user_id, self.backend.get)
+        if not lines:
+            return CartSchema(user_id=user_id, items=[], total_quantity=0, total_price=Decimal("0"))
+        requested = self._lines_values(lines)
+        result = await db.execute(
+            select(
+                ProductModel,
+                requested.c.id.label("line_id"),
+                requested.c.quantity,
+                func.sum(requested.c.quantity).over().label("total_quantity"),
+                func.sum(_line_total(requested.c.quantity, ProductModel.price)).over().label("total_price"),
+            )
+            .join(requested, requested.c.product_id == ProductModel.id)
+            .order_by(requested.c.id)
+        )
+        rows = result.all()
+        return CartSchema(
+            user_id=user_id,
+            items=[CartItemSchema(id=row.line_id, quantity=row.quantity, product=row.Product) for row in rows],
+            total_quantity=rows[0].total_quantity if rows else 0,
+            total_price=rows[0].total_price if rows else Decimal("0"),
+        )
+
+    async def get_summary(self, db: AsyncSession, user_id: int) -> CartSummary:
+        lines = await self._call(db, user_id, self.backend.get)
+        if not lines:
+            return CartSummary(items_count=0, total_quantity=0, total_price=Decimal("0"))
+        requested = self._lines_values(lines)
+        result = await db.execute(
+            select(
+                func.count().label("items_count"),
+                func.sum(requested.c.quantity).label("total_quantity"),
+                func.coalesce(func.sum(_line_total(requested.c.quantity, ProductModel.price)), 0)
+                .label("total_price"),
+            )
+            .select_from(requested)
+            .join(ProductModel, ProductModel.id == requested.c.product_id)
+        )
+        return CartSummary.model_validate(result.one()._asdict())
+
+    async def add_item(
+            self, db: AsyncSession, user_id: int, product_id: int, quantity: int, reserve: ReserveHook | None = None
+    ) -> CartItemSchema:
+        # id новой позиции берём заранее: если позиция уже есть, хранилище оставит прежний
+        row = (await db.execute(
+            select(ProductModel, CART_ITEM_ID_SEQ.next_value().label("line_id"))
+            .where(ProductModel.id == product_id, ProductModel.is_active == True)
+        )).first()
+        if row is None:
+            raise _not_found("Product not found or inactive")
+        line_id, total = await self._call(db, user_id, self.backend.add, product_id, quantity, row.line_id)
+        if reserve is not None:
+            try:
+                await reserve({product_id: total})
+            except BaseException:
+                # Откат вычитанием, а не записью прежнего значения: параллельные добавления сохраняются.
+                # Пустой токен не совпадает ни с одной занятостью корзины
+                await self.backend.consume(user_id, "", [(product_id, quantity)])
+                raise
+        return CartItemSchema(id=line_id, quantity=total, product=row.Product)
+
+    async def set_quantity(
+            self, db: AsyncSession, user_id: int, product_id: int, quantity: int, reserve: ReserveHook | None = None
+    ) -> CartItemSchema:
+        product = await db.scalar(
+            select(ProductModel).where(ProductModel.id == product_id, ProductModel.is_active == True)
+        )
+        if product is None:
+            raise _not_found("Product not found or inactive")
+        if reserve is not None:
+            # Итоговое количество известно заранее: резерв до правки, он зафиксируется вместе с ней
+            await reserve({product_id: quantity})
+        line = await self._call(db, user_id, self.backend.set, product_id, quantity)
+        if line is None:
+            raise _not_found()
+        return CartItemSchema(id=line[0], quantity=line[1], product=product)
+
+    async def remove_item(self, db: AsyncSession, user_id: int, product_id: int) -> None:
+        if not await self._call(db, user_id, self.backend.remove, product_id):
+            raise _not_found()
+
+    async def clear(self, db: AsyncSession, user_id: int) -> None:
+        await self.backend.clear(user_id)
+
+    async def apply(
+            self, db: AsyncSession, user_id: int, actions: CartActions, reserve: ReserveHook | None = None
+    ) -> None:
+        upserts = [product_id for product_id, (op, _) in actions.items() if op != "remove"]
+        line_ids = {}
+        if upserts:
+            result = await db.execute(
+                select(ProductModel.id, CART_ITEM_ID_SEQ.next_value().label("line_id"))
+                .where(ProductModel.id.in_(upserts), ProductModel.is_active == True)
+            )
+            line_ids = dict(result.tuples().all())
+            if error := _missing_products(upserts, line_ids):
+                raise error
+        previous = await self._call(db, user_id, self.backend.get) if reserve is not None else {}
+        quantities = await self._call(db, user_id, self.backend.apply, [
+            (product_id, op, quantity or 0, line_ids.get(product_id, 0))
+            for product_id, (op, quantity) in actions.items()
+        ])
+        if reserve is None:
+            return
+        try:
+            await reserve(quantities)
+        except BaseException:
+            # Возвращаем затронутые позиции к состоянию до пакета
+            await self.backend.apply(user_id, [
+                (product_id, "set", previous[product_id][1], previous[product_id][0])
+                if product_id in previous else (product_id, "remove", 0, 0)
+                for product_id in actions
+            ])
+            raise
+
+    async def snapshot(self, db: AsyncSession, user_id: int) -> CartSnapshot:
+        # Корзина занимается на время оформления: второй checkout той же корзины получает 409,
+        # а правки позиций продолжают работать и после заказа остаются в корзине
+        token = uuid4().hex
+        try:
+            lines = await self._call(db, user_id, self.backend.begin_checkout, token, self.CHECKOUT_LEASE)
+        except CheckoutInProgress:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT, detail="Checkout of this cart is already in progress"
+            )
+        return CartSnapshot(
+            [CartLine(product_id, quantity) for product_id, (_, quantity) in sorted(lines.items())], token
+        )
+
+    async def release(self, user_id: int, snapshot: CartSnapshot) -> None:
+        await self.backend.end_checkout(user_id, snapshot.token)
+
+    async def consume(self, user_id: int, snapshot: CartSnapshot) -> None:
+        # Вычитаются оплаченные количества: если их увеличили во время заказа, остаток сохраняется
+        await self.backend.consume(user_id, snapshot.token, [tuple(line) for line in snapshot.lines])
+
+    async def _flush_batch(self, user_ids: list[int]) -> int:
+        carts = {}
+        for user_id in user_ids:
+            cart = await self.backend.read_for_flush(user_id)
+            if cart is None:
+                # Корзину вытеснили вопреки политике хранилища: записать нечего
+                logger.warning("Cart of user %d was evicted before it was flushed", user_id)
+                await self.backend.mark_clean(user_id, None, CART_TTL)
+                continue
+            carts[user_id] = cart
+        if not carts:
+            return 0
+        rows = [
+            {"id": line_id, "user_id": user_id, "product_id": product_id, "quantity": quantity}
+            for user_id, (_, lines) in carts.items()
+            for product_id, (line_id, quantity) in lines.items()
+        ]
+        async with async_session_maker() as session:
+            # Сначала удаляем исчезнувшие позиции, затем вставляем или обновляем остальные по id
+            await session.execute(
+                delete(CartItemModel).where(
+                    CartItemModel.user_id.in_(list(carts)),
+                    CartItemModel.id.not_in([row["id"] for row in rows]),
+                )
+            )
+            if rows:
+                stmt = insert(CartItemModel)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[CartItemModel.id],
+                    set_={"quantity": stmt.excluded.quantity, "updated_at": func.now()},
+                )
+                await session.execute(stmt, rows)
+            await session.commit()
+        # Пометка снимается, только если корзину не изменили, пока шла запись
+        cleaned = 0
+        for user_id, (version, _) in carts.items():
+            cleaned += await self.backend.mark_clean(user_id, version, CART_TTL)
+        return cleaned
+
+    async def flush(self) -> None:
+        token = uuid4().hex
+        if not await self.backend.acquire_flush_lease(token, self.FLUSH_LEASE):
+            return  # корзины сейчас переносит другой воркер
+        try:
+            while user_ids := await self.backend.dirty_batch(self.batch_size):
+                if not await self._flush_batch(user_ids):
+                    break  # все корзины пачки снова изменились — допишем в следующий раз
+        finally:
+            await self.backend.release_flush_lease(token)
+
+    async def run_flusher(self) -> None:
+        """
+        Фоновая задача: раз в flush_interval переносит изменённые корзины в cart_items.
+        """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Cart flush failed")
+
+
+def create_cart_store(kind: str) -> CartStore:
+    """
+    Выбирает хранилище корзин по CART_STORE: sql — таблица cart_items, kv — хранилище ключ-значение.
+    """
+    if kind == "sql":
+        return SqlCartStore()
+    if kind == "kv":
+        return KeyValueCartStore(create_cart_backend(CART_STORE_URL))
+    raise RuntimeError(f"Unknown CART_STORE: {kind!r}")
+
+
+cart_store = create_cart_store(CART_STORE)
@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import logging
+import time
+import uuid
+
+from pydantic import TypeAdapter
+from sqlalchemy import and_, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cache import CacheBackend, shared_cache
+from app.models.categories import Category as CategoryModel
+from app.models.products import Product as ProductModel
+from app.schemas import Category as CategorySchema, CategoryTreeNode
+
+logger = logging.getLogger("app.category_tree")
+
+_categories_adapter = TypeAdapter(list[CategorySchema])
+_tree_adapter = TypeAdapter(list[CategoryTreeNode])
+
+
+class CategoryTree:
+    """
+    Дерево активных категорий в памяти процесса с заранее сериализованными ответами.
+
+    Перестраивается после изменений категорий. Другие воркеры узнают об этом
+    по номеру версии в общем хранилище (CACHE_URL), а без него — по истечении max_age.
+    Если общее хранилище недоступно, ошибка только логируется: дерево обновится по max_age.
+    """
+
+    VERSION_KEY = "category_tree:version"
+    VERSION_TTL = 30 * 24 * 3600
+
+    def __init__(self, shared: CacheBackend | None = None, max_age: float = 300.0, check_interval: float = 2.0):
+        self.shared = shared
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self.version: str | None = None
+        self.etag: str | None = None
+        self.categories_body = b"[]"
+        self.tree_body = b"[]"
+        self._built_at = 0.0
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def _shared_version(self) -> str | None:
+        """
+        Версия из общего хранилища; при его недоступности — текущая локальная.
+        """
+        if self.shared is None:
+            return None
+        try:
+            raw = await self.shared.get(self.VERSION_KEY)
+        except Exception:
+            logger.warning("Shared cache is unavailable, keeping category tree version", exc_info=True)
+            return self.version
+        return raw.decode() if raw is not None else None
+
+    async def rebuild(self, db: AsyncSession, version: str | None = None) -> None:
+        """
+        Загружает категории с количеством товаров одним запросом и собирает дерево.
+        """
+        # Версию читаем до запроса: если инвалидация случится во время сборки, дерево
+        # сохранится под старой версией и следующая проверка перестроит его
+        if version is None:
+            version = await self._shared_version()
+        result = await db.execute(
+            select(
+                CategoryModel.id,
+                CategoryModel.name,
+                CategoryModel.parent_id,
+                func.count(ProductModel.id).label("product_count"),
+            )
+            .outerjoin(ProductModel, and_(ProductModel.category_id == CategoryModel.id,
+                                          ProductModel.is_active == True))
+            .where(CategoryModel.is_active == True)
+            .group_by(CategoryModel.id)
+            .order_by(CategoryModel.id)
+        )
+        nodes = {
+            row.id: {
+                "id": row.id,
+                "name": row.name,
+                "parent_id": row.parent_id,
+                "product_count": row.product_count,
+                "total_product_count": row.product_count,
+                "children": [],
+            }
+            for row in result.all()
+        }
+        roots = []
+        for node in nodes.values():
+            parent = nodes.get(node["parent_id"])
+            if parent is None:
+                roots.append(node)  # корень или родитель неактивен
+            else:
+                parent["children"].append(node)
+
+        # Суммы по поддеревьям; visited защищает от циклов в parent_id
+        visited = set()
+
+        def subtree_total(node: dict) -> int:
+            visited.add(node["id"])
+            node["total_product_count"] = node["product_count"] + sum(
+                subtree_total(child) for child in node["children"] if child["id"] not in visited
+            )
+            return node["total_product_count"]
+
+        for root in roots:
+            subtree_total(root)
+
+        self.categories_body = _categories_adapter.dump_json(_categories_adapter.validate_python([
+            {"id": node["id"], "name": node["name"], "parent_id": node["parent_id"], "is_active": True}
+            for node in nodes.values()
+        ]))
+        self.tree_body = _tree_adapter.dump_json(_tree_adapter.validate_python(roots))
+        self.etag = f'"{hashlib.sha256(self.tree_body).hexdigest()[:32]}"'
+        self.version = version
+        self._built_at = self._checked_at = time.monotonic()
+
+    async def _is_stale(self) -> bool:
+        now = time.monotonic()
+        if self.etag is None or now - self._built_at >= self.max_age:
+            return True
+        if self.shared is None or now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+        return await self._shared_version() != self.version
+
+    async def ensure_fresh(self, db: AsyncSession) -> None:
+        """
+        Перестраивает дерево, если оно устарело или в общем хранилище новая версия.
+        """
+        if not await self._is_stale():
+            return
+        started_at = time.monotonic()
+        async with self._lock:
+            if self._built_at < started_at:  # пока ждали блокировку, дерево мог пересобрать другой запрос
+                await self.rebuild(db)
+
+    async def invalidate(self, db: AsyncSession) -> None:
+        """
+        Публикует новую версию для остальных воркеров и перестраивает дерево здесь.
+        """
+        version = uuid.uuid4().hex
+        if self.shared is not None:
+            try:
+                await self.shared.set(self.VERSION_KEY, version.encode(), self.VERSION_TTL)
+            except Exception:
+                # Изменение уже зафиксировано: остальные воркеры увидят его по max_age
+                logger.exception("Failed to publish category tree version")
+        async with self._lock:
+            await self.rebuild(db, version)
+
+
+category_tree = CategoryTree(shared=shared_cache)
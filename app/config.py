@@ -5,3 +5,14 @@ from dotenv import load_dotenv
 load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
+# Общий кэш для всех воркеров: redis://... или local:// (локальная замена для тестов)
+CACHE_URL = os.getenv("CACHE_URL")
+# Хранилище корзин: sql — таблица cart_items, kv — хранилище ключ-значение по CART_STORE_URL
+# с отложенной записью в cart_items (без адреса или local:// — в памяти процесса, только для одного воркера)
+CART_STORE = os.getenv("CART_STORE", "sql")
+# Лучше отдельный Redis с maxmemory-policy noeviction или volatile-*: корзины, ещё не записанные
+# в БД, хранятся без TTL и при такой политике не вытесняются
+CART_STORE_URL = os.getenv("CART_STORE_URL", CACHE_URL)
+# Резервирование остатков при добавлении в корзину (выключено по умолчанию) и его срок, сек
+STOCK_RESERVATIONS = os.getenv("STOCK_RESERVATIONS", "false").lower() in ("1", "true", "yes")
+STOCK_RESERVATION_TTL = int(os.getenv("STOCK_RESERVATION_TTL", "900"))
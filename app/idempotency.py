@@ -0,0 +1,90 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException, Response, status
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import async_session_maker
+from app.models.idempotency_keys import IdempotencyKey as IdempotencyKeyModel
+
+logger = logging.getLogger("app.idempotency")
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+IDEMPOTENCY_KEY_TTL = 24 * 3600   # сколько хранится ответ для повтора, сек
+PURGE_INTERVAL = 3600
+
+
+async def claim_idempotency_key(db: AsyncSession, user_id: int, key: str) -> Response | None:
+    """
+    Занимает ключ в текущей транзакции. Если запрос с этим ключом уже выполнен,
+    возвращает сохранённый ответ.
+
+    Параллельный дубликат ждёт на уникальном индексе, пока первая попытка не завершится:
+    после её фиксации он получает готовый ответ, а после отката выполняется заново.
+    """
+    claimed = await db.scalar(
+        insert(IdempotencyKeyModel)
+        .values(user_id=user_id, key=key)
+        .on_conflict_do_nothing(constraint="uq_idempotency_keys_user_key")
+        .returning(IdempotencyKeyModel.id)
+    )
+    if claimed is not None:
+        return None
+
+    stored = (await db.execute(
+        select(IdempotencyKeyModel.status_code, IdempotencyKeyModel.response_body)
+        .where(IdempotencyKeyModel.user_id == user_id, IdempotencyKeyModel.key == key)
+    )).first()
+    if stored is None or stored.response_body is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A request with this Idempotency-Key is still being processed",
+        )
+    return Response(
+        content=stored.response_body,
+        status_code=stored.status_code,
+        media_type="application/json",
+        headers={REPLAYED_HEADER: "true"},
+    )
+
+
+async def store_idempotent_response(
+        db: AsyncSession, user_id: int, key: str, status_code: int, body: str
+) -> None:
+    """
+    Сохраняет ответ в той же транзакции, что и результат запроса.
+    """
+    await db.execute(
+        update(IdempotencyKeyModel)
+        .where(IdempotencyKeyModel.user_id == user_id, IdempotencyKeyModel.key == key)
+        .values(status_code=status_code, response_body=body)
+    )
+
+
+async def purge_expired_keys() -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=IDEMPOTENCY_KEY_TTL)
+    async with async_session_maker() as session:
+        result = await session.execute(
+            delete(IdempotencyKeyModel).where(IdempotencyKeyModel.created_at < cutoff)
+        )
+        await session.commit()
+    return result.rowcount
+
+
+async def run_idempotency_purge() -> None:
+    """
+    Фоновая задача: раз в PURGE_INTERVAL удаляет ключи старше IDEMPOTENCY_KEY_TTL.
+    """
+    while True:
+        await asyncio.sleep(PURGE_INTERVAL)
+        try:
+            removed = await purge_expired_keys()
+            logger.info("Removed %d expired idempotency keys", removed)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Idempotency keys purge failed")
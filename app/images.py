@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from sqlalchemy import update
+
+from app.cache import product_cache
+from app.database import async_session_maker
+from app.models.products import Product as ProductModel
+
+logger = logging.getLogger("app.images")
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+MEDIA_ROOT = BASE_DIR / "media" / "products"
+VARIANTS_ROOT = MEDIA_ROOT / "variants"
+MEDIA_URL = "/media/products"
+
+# Название варианта -> максимальная сторона в пикселях
+IMAGE_VARIANTS = {"thumb": 128, "card": 480, "full": 1200}
+# Расширение файла -> формат Pillow
+VARIANT_FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+# Префикс временных файлов генерации: сборщик медиа удаляет забытые
+VARIANT_TMP_PREFIX = ".variant-"
+
+_executor: ProcessPoolExecutor | None = None
+# Имя оригинала -> задача генерации: повторная загрузка того же файла не запускает вторую
+_pending: dict[str, asyncio.Future] = {}
+_tasks: set[asyncio.Task] = set()
+
+
+def variant_file_name(file_name: str, variant: str, extension: str) -> str:
+    return f"{Path(file_name).stem}_{variant}.{extension}"
+
+
+def variant_urls(image_url: str | None, ready: bool = True) -> dict[str, dict[str, str]] | None:
+    """
+    URL производных изображений по URL оригинала: {"thumb": {"webp": ..., "jpg": ...}, ...}.
+    Файловую систему не трогает: пока варианты не построены (ready=False), их нет в ответе.
+    """
+    if not image_url or not ready:
+        return None
+    file_name = image_url.rsplit("/", 1)[-1]
+    return {
+        variant: {
+            extension: f"{MEDIA_URL}/variants/{variant_file_name(file_name, variant, extension)}"
+            for extension in VARIANT_FORMATS
+        }
+        for variant in IMAGE_VARIANTS
+    }
+
+
+def variant_paths(file_name: str) -> list[Path]:
+    return [
+        VARIANTS_ROOT / variant_file_name(file_name, variant, extension)
+        for variant in IMAGE_VARIANTS
+        for extension in VARIANT_FORMATS
+    ]
+
+
+def has_all_variants(file_name: str) -> bool:
+    """
+    Проверяет файлы вариантов на диске (блокирующий вызов — только вне event loop).
+    """
+    return all(path.is_file() for path in variant_paths(file_name))
+
+
+def generate_variants(source_path: str) -> int:
+    """
+    Строит все варианты изображения (выполняется в процессе пула). Возвращает число файлов.
+    """
+    from PIL import Image, ImageOps  # Pillow нужен только процессам пула
+
+    source = Path(source_path)
+    VARIANTS_ROOT.mkdir(parents=True, exist_ok=True)
+    created = 0
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        for variant, max_side in IMAGE_VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+            for extension, image_format in VARIANT_FORMATS.items():
+                target = VARIANTS_ROOT / variant_file_name(source.name, variant, extension)
+                # Уникальный временный файл: параллельная генерация того же оригинала ему не мешает
+                fd, tmp = tempfile.mkstemp(dir=VARIANTS_ROOT, prefix=VARIANT_TMP_PREFIX, suffix=".part")
+                try:
+                    with os.fdopen(fd, "wb") as tmp_file:
+                        converted = resized.convert("RGB") if image_format == "JPEG" else resized
+                        converted.save(tmp_file, format=image_format, quality=85)
+                    os.chmod(tmp, 0o644)  # mkstemp создаёт файл с правами 0600
+                    os.replace(tmp, target)
+                except BaseException:
+                    Path(tmp).unlink(missing_ok=True)
+                    raise
+                created += 1
+    return created
+
+
+async def mark_variants_ready(image_url: str) -> list[int]:
+    """
+    Отмечает товары с этим изображением: варианты построены. Возвращает id изменённых товаров.
+    Их карточки в кэше сбрасываются — в них ещё нет ссылок на варианты.
+    """
+    async with async_session_maker() as session:
+        product_ids = (await session.scalars(
+            update(ProductModel)
+            .where(ProductModel.image_url == image_url, ProductModel.image_variants_ready == False)
+            .values(image_variants_ready=True)
+            .returning(ProductModel.id)
+        )).all()
+        await session.commit()
+    if product_ids:
+        await product_cache.invalidate(*product_ids)
+    return list(product_ids)
+
+
+async def sync_variants_ready(image_url: str | None) -> None:
+    """
+    Вызывать после коммита товара с новым изображением: если варианты уже построены
+    (дубликат загрузки или генерация успела раньше вставки товара), отмечает товар.
+    """
+    if not image_url:
+        return
+    file_name = image_url.rsplit("/", 1)[-1]
+    if await asyncio.to_thread(has_all_variants, file_name):
+        await mark_variants_ready(image_url)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn, а не fork: родитель — процесс с event loop и потоками
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+async def _record_ready(image_url: str) -> None:
+    try:
+        await mark_variants_ready(image_url)
+    except Exception:
+        logger.exception("Failed to mark image variants of %s as ready", image_url)
+
+
+def _on_generated(file_name: str, future: asyncio.Future) -> None:
+    global _executor
+    _pending.pop(file_name, None)
+    if future.cancelled():
+        return
+    if future.exception() is None:
+        task = asyncio.get_running_loop().create_task(_record_ready(f"{MEDIA_URL}/{file_name}"))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+        return
+    logger.error("Failed to generate image variants", exc_info=future.exception())
+    if isinstance(future.exception(), BrokenProcessPool):
+        _executor = None  # упавший пул не восстанавливается — следующая задача создаст новый
+
+
+def schedule_variants(source_path: Path) -> None:
+    """
+    Отправляет генерацию вариантов в пул процессов, не дожидаясь результата.
+    По завершении товары с этим изображением отмечаются в БД.
+    """
+    file_name = source_path.name
+    if file_name in _pending:
+        return
+    future = asyncio.get_running_loop().run_in_executor(_get_executor(), generate_variants, str(source_path))
+    _pending[file_name] = future
+    future.add_done_callback(lambda done: _on_generated(file_name, done))
+
+
+def shutdown_image_workers() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def backfill_variants() -> int:
+    """
+    Строит недостающие варианты для всех оригиналов в MEDIA_ROOT и отмечает товары.
+    Возвращает число оригиналов с полным набором вариантов.
+
+    Запуск: python -m app.images
+    """
+    sources = [
+        path for path in MEDIA_ROOT.iterdir()
+        if path.is_file() and not path.name.startswith(".") and path.suffix not in (".br", ".gz")
+    ]
+    ready = 0
+    with ProcessPoolExecutor(max_workers=IMAGE_WORKERS) as executor:
+        futures = {
+            path: None if has_all_variants(path.name) else executor.submit(generate_variants, str(path))
+            for path in sources
+        }
+        for path, future in futures.items():
+            try:
+                if future is not None:
+                    await asyncio.wrap_future(future)
+            except Exception:
+                logger.exception("Failed to generate image variants for %s", path.name)
+                continue
+            await mark_variants_ready(f"{MEDIA_URL}/{path.name}")
+            ready += 1
+    return ready
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.info("%d images have all variants", asyncio.run(backfill_variants()))
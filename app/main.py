@@ -1,20 +1,83 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
 import uvicorn
 from fastapi import FastAPI, Request, status
-from fastapi.staticfiles import StaticFiles
 
 from fastapi.responses import JSONResponse
 from pydantic import ValidationError
 
 from app.routers import categories, products, users, reviews, cart, orders
+from app.auth import shutdown_password_workers
+from app.database import QUERY_COUNT_HEADER, QUERY_TIME_HEADER, logger as db_logger, track_queries
+from app.database import async_session_maker
+from app.cart_store import cart_store, logger as cart_logger
+from app.category_tree import category_tree
+from app.config import STOCK_RESERVATIONS
+from app.idempotency import run_idempotency_purge
+from app.images import shutdown_image_workers
+from app.media import MediaFiles
+from app.media_gc import run_media_gc
+from app.outbox import run_outbox_worker
+from app.reservations import run_reservation_sweeper
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Прогревает данные в памяти, запускает фоновые задачи и останавливает их при выходе.
+    """
+    async with async_session_maker() as session:
+        await category_tree.rebuild(session)
+    tasks = [
+        asyncio.create_task(run_media_gc()),
+        asyncio.create_task(run_idempotency_purge()),
+        asyncio.create_task(run_outbox_worker()),
+    ]
+    if cart_store.write_behind:
+        tasks.append(asyncio.create_task(cart_store.run_flusher()))
+    if STOCK_RESERVATIONS:
+        tasks.append(asyncio.create_task(run_reservation_sweeper()))
+    yield
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        with suppress(asyncio.CancelledError):
+            await task
+    try:
+        await cart_store.flush()  # не теряем отложенные изменения корзин при остановке
+    except Exception:
+        cart_logger.exception("Final cart flush failed")
+    shutdown_image_workers()
+    shutdown_password_workers()
 
 
 # Создаём приложение FastAPI
 app = FastAPI(
     title="FastAPI Интернет-магазин",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
-app.mount("/media", StaticFiles(directory="media"), name="media")
+app.mount("/media", MediaFiles(directory="media"), name="media")
+
+
+@app.middleware("http")
+async def count_db_queries(request: Request, call_next):
+    """
+    Отдаёт количество SQL-запросов и время в БД в заголовках ответа, предупреждает о N+1.
+    """
+    with track_queries() as stats:
+        response = await call_next(request)
+    db_time_ms = stats.total_time * 1000
+    response.headers[QUERY_COUNT_HEADER] = str(stats.count)
+    response.headers[QUERY_TIME_HEADER] = f"{db_time_ms:.1f}"
+    db_logger.debug("%s %s: %d queries, %.1f ms in DB",
+                    request.method, request.url.path, stats.count, db_time_ms)
+    for statement, times in stats.repeated():
+        db_logger.warning("Possible N+1 in %s %s: executed %d times: %s",
+                          request.method, request.url.path, times, statement)
+    return response
 
 # # Handle general Pydantic validation errors that might slip through  # for .as_form uncaught
 ## moved to ProductCreate schema .as_form try/except
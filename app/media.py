@@ -0,0 +1,97 @@
+import mimetypes
+import os
+import stat
+from pathlib import Path
+
+import anyio
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+from starlette.types import Scope
+
+# Имена файлов в /media уникальны (хеш содержимого или uuid) и никогда не перезаписываются
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Предсжатые копии рядом с файлом: <имя>.br / <имя>.gz
+PRECOMPRESSED_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+MEDIA_CHUNK_SIZE = 256 * 1024
+
+
+def _encoding_qualities(accept_encoding: str) -> dict[str, float]:
+    """
+    Разбирает Accept-Encoding в {кодировка: q}. Некорректный q считается нулём.
+    """
+    qualities = {}
+    for item in accept_encoding.split(","):
+        name, *params = item.split(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+    return qualities
+
+
+def _preferred_encodings(accept_encoding: str) -> list[tuple[str, str]]:
+    """
+    Предсжатые варианты, которые принимает клиент: по убыванию q, при равенстве — в порядке
+    PRECOMPRESSED_ENCODINGS. q=0 означает отказ, * задаёт q для неперечисленных кодировок.
+    """
+    qualities = _encoding_qualities(accept_encoding)
+    default = qualities.get("*", 0.0)
+    accepted = [
+        (qualities.get(encoding, default), -index, encoding, suffix)
+        for index, (encoding, suffix) in enumerate(PRECOMPRESSED_ENCODINGS)
+    ]
+    return [(encoding, suffix) for quality, _, encoding, suffix in sorted(accepted, reverse=True) if quality > 0]
+
+
+class MediaFiles(StaticFiles):
+    """
+    Раздача медиафайлов с долгим кэшированием, сильными ETag и предсжатыми вариантами.
+
+    Range-запросы и zero-copy отправка (http.response.pathsend, если сервер её поддерживает)
+    обеспечиваются FileResponse из Starlette.
+    """
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] in ("GET", "HEAD"):
+            accept_encoding = Headers(scope=scope).get("accept-encoding", "")
+            for encoding, suffix in _preferred_encodings(accept_encoding):
+                full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+                if stat_result and stat.S_ISREG(stat_result.st_mode):
+                    return self.file_response(full_path, stat_result, scope, encoding=encoding)
+        return await super().get_response(path, scope)
+
+    def file_response(
+        self,
+        full_path: os.PathLike | str,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+        encoding: str | None = None,
+    ) -> Response:
+        file_name = Path(full_path).name
+        if encoding is not None:
+            file_name = file_name.rsplit(".", 1)[0]  # тип и ETag — по исходному файлу
+        media_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+        # Содержимое файла не меняется, поэтому ETag — само имя (для хеш-имён это и есть хеш)
+        etag = f'"{Path(file_name).stem}{"-" + encoding if encoding else ""}"'
+
+        headers = {"cache-control": IMMUTABLE_CACHE_CONTROL, "etag": etag, "vary": "Accept-Encoding"}
+        if encoding is not None:
+            headers["content-encoding"] = encoding
+
+        response = FileResponse(full_path, status_code=status_code, headers=headers,
+                                media_type=media_type, stat_result=stat_result)
+        response.chunk_size = MEDIA_CHUNK_SIZE
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
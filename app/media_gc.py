@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import os
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+
+from app.database import async_session_maker
+from app.images import MEDIA_ROOT, MEDIA_URL, VARIANTS_ROOT, variant_paths
+from app.media import PRECOMPRESSED_ENCODINGS
+from app.models.products import Product as ProductModel
+
+logger = logging.getLogger("app.media_gc")
+
+GC_INTERVAL = 3600           # полный обход каталога, сек
+GC_PENDING_INTERVAL = 60     # проверка файлов, от которых товары только что отказались, сек
+GC_GRACE_PERIOD = 3600       # файлы моложе этого не трогаем: их могла только что записать загрузка
+GC_BATCH_SIZE = 500
+# Расширения оригиналов: по ним вариант находит свой исходный файл (.jpeg — старые загрузки)
+ORIGINAL_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+COMPRESSED_SUFFIXES = tuple(suffix for _, suffix in PRECOMPRESSED_ENCODINGS)
+
+
+@dataclass
+class GcStats:
+    runs: int = 0
+    scanned: int = 0
+    removed: int = 0
+    reclaimed_bytes: int = 0
+    last_run_at: float | None = None
+    last_duration: float = 0.0
+
+
+gc_stats = GcStats()
+_pending_urls: set[str] = set()
+
+
+def schedule_image_cleanup(url: str | None) -> None:
+    """
+    Помечает файл для проверки сборщиком; само удаление происходит в фоне.
+    """
+    if url and url.startswith(MEDIA_URL + "/"):
+        _pending_urls.add(url)
+
+
+def _scan_batches(batch_size: int, root: Path = MEDIA_ROOT) -> Iterator[list[os.DirEntry]]:
+    batch = []
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                batch.append(entry)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+
+def _original_name(name: str) -> str:
+    """
+    Имя оригинала для предсжатой копии (<имя>.br / <имя>.gz) или само имя.
+    """
+    for suffix in COMPRESSED_SUFFIXES:
+        if name.endswith(suffix):
+            return name.removesuffix(suffix)
+    return name
+
+
+def _media_paths(name: str) -> list[Path]:
+    """
+    Файл и всё, что от него построено: предсжатые копии и варианты.
+    """
+    if name.startswith(".") or _original_name(name) != name:
+        return [MEDIA_ROOT / name]
+    return [MEDIA_ROOT / name, *(MEDIA_ROOT / f"{name}{suffix}" for suffix in COMPRESSED_SUFFIXES),
+            *variant_paths(name)]
+
+
+def _remove_orphans(names: list[str], cutoff: float) -> tuple[int, int]:
+    """
+    Удаляет файлы (с предсжатыми копиями и вариантами), не изменявшиеся с cutoff. Возвращает (файлов, байт).
+    """
+    removed = reclaimed = 0
+    for name in names:
+        for path in _media_paths(name):
+            try:
+                file_stat = path.stat()
+                # mtime перечитываем прямо перед удалением: дубликат мог «оживить» файл
+                if file_stat.st_mtime >= cutoff:
+                    break
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            removed += 1
+            reclaimed += file_stat.st_size
+    return removed, reclaimed
+
+
+async def _collect(names: list[str], cutoff: float) -> None:
+    """
+    Сверяет пачку имён с Product.image_url одним запросом и удаляет неиспользуемые.
+    """
+    # Временные файлы незавершённых загрузок
+    candidates = [name for name in names if name.startswith(".upload-")]
+    # Предсжатая копия живёт, пока нужен её оригинал
+    urls = {name: f"{MEDIA_URL}/{_original_name(name)}" for name in names if not name.startswith(".")}
+    if urls:
+        async with async_session_maker() as session:
+            referenced = set((await session.scalars(
+                select(ProductModel.image_url)
+                .where(ProductModel.image_url.in_(set(urls.values())), ProductModel.is_active == True)
+            )).all())
+        candidates += [name for name, url in urls.items() if url not in referenced]
+
+    removed, reclaimed = await run_in_threadpool(_remove_orphans, candidates, cutoff)
+    gc_stats.scanned += len(names)
+    gc_stats.removed += removed
+    gc_stats.reclaimed_bytes += reclaimed
+
+
+def _remove_orphan_variants(names: list[str], cutoff: float) -> tuple[int, int]:
+    """
+    Удаляет в VARIANTS_ROOT временные файлы прерванной генерации и варианты без оригинала,
+    не изменявшиеся с cutoff. Возвращает (файлов, байт).
+    """
+    removed = reclaimed = 0
+    for name in names:
+        if not name.startswith("."):
+            stem = name.rsplit("_", 1)[0]
+            if any((MEDIA_ROOT / f"{stem}{extension}").exists() for extension in ORIGINAL_EXTENSIONS):
+                continue
+        path = VARIANTS_ROOT / name
+        try:
+            file_stat = path.stat()
+            if file_stat.st_mtime >= cutoff:
+                continue
+            path.unlink()
+        except FileNotFoundError:
+            continue
+        removed += 1
+        reclaimed += file_stat.st_size
+    return removed, reclaimed
+
+
+async def sweep_pending() -> None:
+    """
+    Проверяет только файлы, помеченные через schedule_image_cleanup.
+    """
+    if not _pending_urls:
+        return
+    urls = list(_pending_urls)
+    _pending_urls.difference_update(urls)
+    names = [url.rsplit("/", 1)[-1] for url in urls]
+    cutoff = time.time() - GC_GRACE_PERIOD
+    for start in range(0, len(names), GC_BATCH_SIZE):
+        await _collect(names[start:start + GC_BATCH_SIZE], cutoff)
+
+
+async def sweep_media() -> None:
+    """
+    Полный обход каталога изображений пачками, без загрузки всего списка в память.
+    """
+    started_at = time.monotonic()
+    removed_before, reclaimed_before = gc_stats.removed, gc_stats.reclaimed_bytes
+    cutoff = time.time() - GC_GRACE_PERIOD
+
+    batches = _scan_batches(GC_BATCH_SIZE)
+    while (batch := await run_in_threadpool(next, batches, None)) is not None:
+        await _collect([entry.name for entry in batch], cutoff)
+
+    # Варианты: оригиналы удаляются вместе с ними, здесь — остатки сбоев
+    if await run_in_threadpool(VARIANTS_ROOT.is_dir):
+        batches = _scan_batches(GC_BATCH_SIZE, VARIANTS_ROOT)
+        while (batch := await run_in_threadpool(next, batches, None)) is not None:
+            removed, reclaimed = await run_in_threadpool(
+                _remove_orphan_variants, [entry.name for entry in batch], cutoff
+            )
+            gc_stats.scanned += len(batch)
+            gc_stats.removed += removed
+            gc_stats.reclaimed_bytes += reclaimed
+
+    gc_stats.runs += 1
+    gc_stats.last_run_at = time.time()
+    gc_stats.last_duration = time.monotonic() - started_at
+    logger.info("Media GC: removed %d files, reclaimed %d bytes in %.1f s",
+                gc_stats.removed - removed_before, gc_stats.reclaimed_bytes - reclaimed_before,
+                gc_stats.last_duration)
+
+
+async def run_media_gc() -> None:
+    """
+    Фоновая задача: часто — помеченные файлы, раз в GC_INTERVAL — полный обход.
+    """
+    last_full_sweep = time.monotonic()  # не нагружаем диск и БД сразу при старте всех воркеров
+    while True:
+        try:
+            if time.monotonic() - last_full_sweep >= GC_INTERVAL:
+                await sweep_media()
+                last_full_sweep = time.monotonic()
+            else:
+                await sweep_pending()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Media GC run failed")
+        await asyncio.sleep(GC_PENDING_INTERVAL)
@@ -0,0 +1,28 @@
+"""add products category index
+
+Revision ID: f5d5e3ca26de
+Revises: 2b76e4ee60c6
+Create Date: 2026-10-17 09:30:12.418305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f5d5e3ca26de'
+down_revision: Union[str, Sequence[str], None] = '2b76e4ee60c6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_products_category_id_id', 'products', ['category_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_products_category_id_id', table_name='products')
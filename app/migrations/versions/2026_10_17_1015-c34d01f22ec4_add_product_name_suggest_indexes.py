@@ -0,0 +1,32 @@
+"""add product name suggest indexes
+
+Revision ID: c34d01f22ec4
+Revises: f5d5e3ca26de
+Create Date: 2026-10-17 10:15:47.205931
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c34d01f22ec4'
+down_revision: Union[str, Sequence[str], None] = 'f5d5e3ca26de'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index('ix_products_name_prefix', 'products', [sa.text('lower(name) text_pattern_ops')], unique=False)
+    op.create_index('ix_products_name_trgm', 'products', [sa.text('lower(name) gin_trgm_ops')], unique=False,
+                    postgresql_using='gin')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_products_name_trgm', table_name='products', postgresql_using='gin')
+    op.drop_index('ix_products_name_prefix', table_name='products')
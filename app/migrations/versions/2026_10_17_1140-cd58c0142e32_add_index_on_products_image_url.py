@@ -0,0 +1,28 @@
+"""add index on products image_url
+
+Revision ID: cd58c0142e32
+Revises: c34d01f22ec4
+Create Date: 2026-10-17 11:40:03.671254
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'cd58c0142e32'
+down_revision: Union[str, Sequence[str], None] = 'c34d01f22ec4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_products_image_url'), 'products', ['image_url'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_products_image_url'), table_name='products')
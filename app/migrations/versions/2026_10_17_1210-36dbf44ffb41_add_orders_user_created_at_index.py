@@ -0,0 +1,28 @@
+"""add orders (user_id, created_at, id) index
+
+Revision ID: 36dbf44ffb41
+Revises: cd58c0142e32
+Create Date: 2026-10-17 12:10:41.208734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '36dbf44ffb41'
+down_revision: Union[str, Sequence[str], None] = 'cd58c0142e32'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_orders_user_id_created_at_id', 'orders', ['user_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_orders_user_id_created_at_id', table_name='orders')
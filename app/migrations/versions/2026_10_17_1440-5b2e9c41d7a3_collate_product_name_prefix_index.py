@@ -0,0 +1,30 @@
+"""collate product name prefix index
+
+Revision ID: 5b2e9c41d7a3
+Revises: 69367727cb93
+Create Date: 2026-10-17 14:40:12.518304
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b2e9c41d7a3'
+down_revision: Union[str, Sequence[str], None] = '69367727cb93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.drop_index('ix_products_name_prefix', table_name='products')
+    op.create_index('ix_products_name_prefix', 'products', [sa.text('lower(name) COLLATE "C"')], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_products_name_prefix', table_name='products')
+    op.create_index('ix_products_name_prefix', 'products', [sa.text('lower(name) text_pattern_ops')], unique=False)
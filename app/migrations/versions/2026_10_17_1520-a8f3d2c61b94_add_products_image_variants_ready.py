@@ -0,0 +1,30 @@
+"""add products image_variants_ready
+
+Revision ID: a8f3d2c61b94
+Revises: 5b2e9c41d7a3
+Create Date: 2026-10-17 15:20:41.730215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8f3d2c61b94'
+down_revision: Union[str, Sequence[str], None] = '5b2e9c41d7a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Существующие изображения отмечает python -m app.images (строит недостающие варианты)
+    op.add_column('products', sa.Column('image_variants_ready', sa.Boolean(), server_default=sa.text('false'),
+                                        nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('products', 'image_variants_ready')
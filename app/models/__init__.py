@@ -4,6 +4,9 @@ from .users import User
 from .reviews import Review
 from .cart_items import CartItem
 from .orders import Order, OrderItem
+from .idempotency_keys import IdempotencyKey
+from .outbox import OutboxEvent
+from .stock_reservations import StockReservation
 
 
-__all__ = ["Category", "Product", "User", "CartItem", "Order", "OrderItem"]
+__all__ = ["Category", "Product", "User", "CartItem", "Order", "OrderItem", "IdempotencyKey", "OutboxEvent", "StockReservation"]
@@ -13,7 +13,9 @@ class Product(Base):
     name: Mapped[str] = mapped_column(String(100), nullable=False)
     description: Mapped[str | None] = mapped_column(String(500), nullable=True)
     price: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False)
-    image_url: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    image_url: Mapped[str | None] = mapped_column(String(200), nullable=True, index=True)  # подсчёт ссылок на файл
+    # Варианты изображения построены: отмечает пул генерации, ответы API не проверяют диск
+    image_variants_ready: Mapped[bool] = mapped_column(Boolean, default=False, server_default=text("false"))
     stock: Mapped[int] = mapped_column(Integer, nullable=False)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
     category_id: Mapped[int] = mapped_column(ForeignKey("categories.id"), nullable=False)
@@ -41,4 +43,9 @@ class Product(Base):
 
     __table_args__ = (
         Index("ix_products_tsv_gin", "tsv", postgresql_using="gin"),
+        Index("ix_products_category_id_id", "category_id", "id"),  # листинг категории по курсору
+        # Автодополнение: префиксный поиск (btree в порядке "C" — годится и для LIKE, и для ORDER BY)
+        # и поиск подстроки (pg_trgm)
+        Index("ix_products_name_prefix", text('lower(name) COLLATE "C"')),
+        Index("ix_products_name_trgm", text("lower(name) gin_trgm_ops"), postgresql_using="gin"),
     )
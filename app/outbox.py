@@ -0,0 +1,149 @@
+import asyncio
+import logging
+from collections import defaultdict
+from collections.abc import Awaitable, Callable
+from datetime import timedelta
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import async_session_maker
+from app.models.outbox import OutboxEvent as OutboxEventModel
+
+logger = logging.getLogger("app.outbox")
+
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_POLL_INTERVAL = 1.0      # пауза, когда очередь пуста, сек
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_MAX_BACKOFF = 3600       # потолок паузы между попытками, сек
+OUTBOX_HANDLER_TIMEOUT = 30     # предел на все обработчики одного события, сек
+OUTBOX_LEASE = 300              # на сколько воркер забирает пачку событий, сек
+
+Handler = Callable[[dict], Awaitable[None]]
+_handlers: dict[str, list[Handler]] = defaultdict(list)
+
+
+def register_handler(event_type: str) -> Callable[[Handler], Handler]:
+    """
+    Регистрирует обработчик события. Обработчиков у события может быть несколько;
+    доставка «хотя бы один раз», поэтому они должны быть идемпотентными.
+    """
+    def decorator(handler: Handler) -> Handler:
+        _handlers[event_type].append(handler)
+        return handler
+    return decorator
+
+
+async def add_event(db: AsyncSession, event_type: str, payload: dict) -> None:
+    """
+    Записывает событие в outbox в текущей транзакции — оно появится только вместе с её фиксацией.
+    """
+    await db.execute(insert(OutboxEventModel).values(event_type=event_type, payload=payload))
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(2 ** attempts, OUTBOX_MAX_BACKOFF))
+
+
+async def _claim_batch(batch_size: int) -> list:
+    """
+    Забирает пачку готовых событий в аренду на OUTBOX_LEASE и сразу фиксирует это.
+
+    Аренда — сдвиг available_at: другие воркеры не видят событие, пока она не истечёт,
+    а если воркер упадёт, событие вернётся в очередь само.
+    """
+    async with async_session_maker() as session:
+        ready = (
+            select(OutboxEventModel.id)
+            .where(OutboxEventModel.status == "pending", OutboxEventModel.available_at <= func.now())
+            .order_by(OutboxEventModel.available_at, OutboxEventModel.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        events = (await session.execute(
+            update(OutboxEventModel)
+            .where(OutboxEventModel.id.in_(ready))
+            .values(available_at=func.now() + timedelta(seconds=OUTBOX_LEASE))
+            .returning(OutboxEventModel.id, OutboxEventModel.event_type,
+                       OutboxEventModel.payload, OutboxEventModel.attempts)
+        )).all()
+        await session.commit()
+    return sorted(events, key=lambda event: event.id)
+
+
+async def _dispatch(event_type: str, payload: dict) -> None:
+    for handler in _handlers.get(event_type, []):
+        await handler(payload)
+
+
+async def process_batch(batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    """
+    Обрабатывает пачку готовых событий. Возвращает их количество.
+
+    Обработчики выполняются вне транзакции выборки: строки не держат блокировок и соединение
+    не простаивает «idle in transaction». Каждое событие ограничено OUTBOX_HANDLER_TIMEOUT,
+    а события, до которых не дошли до конца аренды, сразу возвращаются в очередь.
+    Успешные события удаляются, неудачные откладываются с экспоненциальной паузой,
+    после OUTBOX_MAX_ATTEMPTS — failed.
+    """
+    events = await _claim_batch(batch_size)
+    if not events:
+        return 0
+
+    loop = asyncio.get_running_loop()
+    # Последнее событие должно успеть завершиться до конца аренды, иначе его возьмёт другой воркер
+    deadline = loop.time() + OUTBOX_LEASE - OUTBOX_HANDLER_TIMEOUT
+    done_ids, unclaimed_ids, failures = [], [], []
+    for event in events:
+        if loop.time() > deadline:
+            unclaimed_ids.append(event.id)
+            continue
+        try:
+            await asyncio.wait_for(_dispatch(event.event_type, event.payload), OUTBOX_HANDLER_TIMEOUT)
+        except Exception as ex:
+            failures.append((event, ex))
+            continue
+        done_ids.append(event.id)
+
+    async with async_session_maker() as session:
+        if done_ids:
+            await session.execute(delete(OutboxEventModel).where(OutboxEventModel.id.in_(done_ids)))
+        if unclaimed_ids:
+            await session.execute(
+                update(OutboxEventModel)
+                .where(OutboxEventModel.id.in_(unclaimed_ids))
+                .values(available_at=func.now())
+            )
+        for event, ex in failures:
+            attempts = event.attempts + 1
+            values = {"attempts": attempts, "last_error": repr(ex)[:2000]}
+            if attempts >= OUTBOX_MAX_ATTEMPTS:
+                values["status"] = "failed"
+                logger.error("Outbox event %d (%s) failed permanently: %r", event.id, event.event_type, ex)
+            else:
+                values["available_at"] = func.now() + _backoff(attempts)
+            await session.execute(update(OutboxEventModel).where(OutboxEventModel.id == event.id).values(**values))
+        await session.commit()
+    return len(events)
+
+
+async def run_outbox_worker() -> None:
+    """
+    Фоновая задача: разбирает outbox пачками, пока есть работа, затем ждёт OUTBOX_POLL_INTERVAL.
+    """
+    while True:
+        try:
+            processed = await process_batch()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Outbox batch failed")
+            processed = 0
+        if processed < OUTBOX_BATCH_SIZE:
+            await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+
+
+@register_handler("order.created")
+async def _log_order_created(payload: dict) -> None:
+    logger.info("Order %s created by user %s for %s", payload["order_id"], payload["user_id"], payload["total_amount"])
@@ -0,0 +1,24 @@
+import base64
+import json
+
+from fastapi import HTTPException, status
+
+
+def encode_cursor(**values) -> str:
+    """
+    Упаковывает значения ключа сортировки последней записи в непрозрачный курсор.
+    """
+    raw = json.dumps(values, separators=(",", ":"), sort_keys=True).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, **types) -> dict:
+    """
+    Распаковывает курсор и приводит значения к ожидаемым типам (ключ -> тип).
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return {key: cast(values[key]) for key, cast in types.items()}
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from fastapi import HTTPException, status
+from sqlalchemy import Integer, column, delete, func, literal, select, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import STOCK_RESERVATION_TTL
+from app.database import async_session_maker
+from app.models.products import Product as ProductModel
+from app.models.stock_reservations import StockReservation as ReservationModel
+
+logger = logging.getLogger("app.reservations")
+
+SWEEP_INTERVAL = 60
+SWEEP_BATCH_SIZE = 1000
+
+
+def reserved_by_others(product_id, user_id: int):
+    """
+    Сумма активных резервов товара, кроме резерва самого пользователя (коррелированный подзапрос).
+    """
+    return func.coalesce(
+        select(func.sum(ReservationModel.quantity))
+        .where(
+            ReservationModel.product_id == product_id,
+            ReservationModel.user_id != user_id,
+            ReservationModel.expires_at > func.now(),
+        )
+        .scalar_subquery(),
+        0,
+    )
+
+
+async def reserve_stock(db: AsyncSession, user_id: int, quantities: dict[int, int]) -> None:
+    """
+    Задаёт резервы корзины пользователя {product_id: количество в корзине} на STOCK_RESERVATION_TTL
+    одним запросом.
+
+    Доступный остаток — stock минус активные резервы других покупателей. Строки товаров
+    блокируются (FOR NO KEY UPDATE) до конца транзакции вызывающего, поэтому параллельные
+    резервы одного товара выполняются по очереди и не превышают остаток. Транзакцию функция
+    не фиксирует.
+    """
+    if not quantities:
+        return
+    # Блокировка — отдельным запросом: в READ COMMITTED следующий запрос берёт новый снимок
+    # и видит резервы, зафиксированные теми, кого мы ждали. Блокировка внутри INSERT ... SELECT
+    # считала бы чужие резервы по снимку, взятому до ожидания. Порядок id исключает взаимоблокировки
+    await db.execute(
+        select(ProductModel.id)
+        .where(ProductModel.id.in_(list(quantities)))
+        .order_by(ProductModel.id)
+        .with_for_update(key_share=True)
+    )
+    requested = values(
+        column("product_id", Integer), column("quantity", Integer), name="requested"
+    ).data(list(quantities.items()))
+    expires_at = func.now() + timedelta(seconds=STOCK_RESERVATION_TTL)
+    stmt = insert(ReservationModel).from_select(
+        ["user_id", "product_id", "quantity", "expires_at"],
+        select(literal(user_id), ProductModel.id, requested.c.quantity, expires_at)
+        .select_from(requested)
+        .join(ProductModel, ProductModel.id == requested.c.product_id)
+        .where(
+            ProductModel.is_active == True,
+            ProductModel.stock - reserved_by_others(ProductModel.id, user_id) >= requested.c.quantity,
+        ),
+    )
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_stock_reservations_user_product",
+        set_={"quantity": stmt.excluded.quantity, "expires_at": stmt.excluded.expires_at},
+    )
+    reserved = set((await db.scalars(stmt.returning(ReservationModel.product_id))).all())
+    failed = sorted(set(quantities) - reserved)
+    if not failed:
+        return
+
+    # Дополнительный запрос только на пути ошибки — чтобы объяснить отказ
+    products = {
+        product.id: product
+        for product in await db.scalars(
+            select(ProductModel).where(ProductModel.id.in_(failed), ProductModel.is_active == True)
+        )
+    }
+    if len(products) < len(failed):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Product not found or inactive",
+        )
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Not enough stock for product {products[failed[0]].name}",
+    )
+
+
+async def release_reservations(db: AsyncSession, user_id: int, product_ids: list[int] | None = None) -> None:
+    """
+    Снимает резервы пользователя (все или по указанным товарам) в текущей транзакции.
+    """
+    stmt = delete(ReservationModel).where(ReservationModel.user_id == user_id)
+    if product_ids is not None:
+        stmt = stmt.where(ReservationModel.product_id.in_(product_ids))
+    await db.execute(stmt)
+
+
+async def sweep_expired_reservations() -> int:
+    """
+    Удаляет истёкшие резервы пачками по SWEEP_BATCH_SIZE. Возвращает их количество.
+    """
+    removed = 0
+    while True:
+        async with async_session_maker() as session:
+            expired = (
+                select(ReservationModel.id)
+                .where(ReservationModel.expires_at <= func.now())
+                .limit(SWEEP_BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+                .scalar_subquery()
+            )
+            result = await session.execute(delete(ReservationModel).where(ReservationModel.id.in_(expired)))
+            await session.commit()
+        removed += result.rowcount
+        if result.rowcount < SWEEP_BATCH_SIZE:
+            return removed
+
+
+async def run_reservation_sweeper() -> None:
+    """
+    Фоновая задача: раз в SWEEP_INTERVAL удаляет истёкшие резервы.
+    """
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        try:
+            removed = await sweep_expired_reservations()
+            if removed:
+                logger.info("Removed %d expired stock reservations", removed)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Stock reservations sweep failed")
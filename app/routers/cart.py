@@ -1,50 +1,52 @@
-from decimal import Decimal
-from fastapi import APIRouter, Depends, HTTPException, Response, status
-from sqlalchemy import delete, select
+from fastapi import APIRouter, Depends, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
 from app.auth import get_current_user
+from app.cart_store import CartActions, ReserveHook, cart_store
+from app.config import STOCK_RESERVATIONS
 from app.db_depends import get_async_db
-from app.models.cart_items import CartItem as CartItemModel
-from app.models.products import Product as ProductModel
 from app.models.users import User as UserModel
+from app.reservations import release_reservations, reserve_stock
 from app.schemas import (
     Cart as CartSchema,
+    CartBatchUpdate,
     CartItem as CartItemSchema,
     CartItemCreate,
     CartItemUpdate,
+    CartSummary,
 )
 
 router = APIRouter(prefix="/cart", tags=["cart"])
 
-async def _ensure_product_available(db: AsyncSession, product_id: int) -> None:
-    result = await db.scalars(
-        select(ProductModel).where(
-            ProductModel.id == product_id,
-            ProductModel.is_active == True,
-        )
-    )
-    product = result.first()
-    if not product:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Product not found or inactive",
-        )
-
-
-async def _get_cart_item(
-    db: AsyncSession, user_id: int, product_id: int
-) -> CartItemModel | None:
-    result = await db.scalars(
-        select(CartItemModel)
-        .options(selectinload(CartItemModel.product))
-        .where(
-            CartItemModel.user_id == user_id,
-            CartItemModel.product_id == product_id,
-        )
-    )
-    return result.first()
+
+def _reserve_hook(db: AsyncSession, user_id: int) -> ReserveHook | None:
+    """
+    Резерв остатков под итоговые количества позиций корзины (если резервирование включено).
+    """
+    if not STOCK_RESERVATIONS:
+        return None
+
+    async def reserve(quantities: dict[int, int]) -> None:
+        await reserve_stock(db, user_id, quantities)
+
+    return reserve
+
+
+def _collapse_operations(payload: CartBatchUpdate) -> CartActions:
+    """
+    Сворачивает операции по товару в одно итоговое действие:
+    ("add", n) — прибавить к текущему количеству, ("set", n) — задать, ("remove", None) — удалить.
+    """
+    actions: CartActions = {}
+    for operation in payload.operations:
+        previous = actions.get(operation.product_id)
+        if operation.op == "add" and previous is not None and previous[0] != "remove":
+            actions[operation.product_id] = (previous[0], previous[1] + operation.quantity)
+        elif operation.op == "add" and previous is not None:
+            actions[operation.product_id] = ("set", operation.quantity)  # после удаления — с нуля
+        else:
+            actions[operation.product_id] = (operation.op, operation.quantity)
+    return actions
 
 
 @router.get("/", response_model=CartSchema)
@@ -52,28 +54,18 @@ async def get_cart(
     db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user),
 ):
-    result = await db.scalars(
-        select(CartItemModel)
-        .options(selectinload(CartItemModel.product))
-        .where(CartItemModel.user_id == current_user.id)
-        .order_by(CartItemModel.id)
-    )
-    items = result.all()
+    return await cart_store.get_cart(db, current_user.id)
 
-    total_quantity = sum(item.quantity for item in items)
-    price_items = (
-        Decimal(item.quantity) *
-        (item.product.price if item.product.price is not None else Decimal("0"))
-        for item in items
-    )
-    total_price_decimal = sum(price_items, Decimal("0"))
 
-    return CartSchema(
-        user_id=current_user.id,
-        items=items,
-        total_quantity=total_quantity,
-        total_price=total_price_decimal
-    )
+@router.get("/summary", response_model=CartSummary)
+async def get_cart_summary(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    """
+    Количество и сумма корзины одним агрегирующим запросом, без загрузки ORM-объектов.
+    """
+    return await cart_store.get_summary(db, current_user.id)
 
 
 @router.post("/items", response_model=CartItemSchema, status_code=status.HTTP_201_CREATED)
@@ -82,22 +74,33 @@ async def add_item_to_cart(
     db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user),
 ):
-    await _ensure_product_available(db, payload.product_id)
+    cart_item = await cart_store.add_item(
+        db, current_user.id, payload.product_id, payload.quantity, reserve=_reserve_hook(db, current_user.id)
+    )
+    if STOCK_RESERVATIONS:
+        await db.commit()  # хранилище kv не фиксирует транзакцию с резервом само
+    return cart_item
 
-    cart_item = await _get_cart_item(db, current_user.id, payload.product_id)
-    if cart_item:
-        cart_item.quantity += payload.quantity
-    else:
-        cart_item = CartItemModel(
-            user_id=current_user.id,
-            product_id=payload.product_id,
-            quantity=payload.quantity,
-        )
-        db.add(cart_item)
 
-    await db.commit()
-    updated_item = await _get_cart_item(db, current_user.id, payload.product_id)
-    return updated_item
+@router.post("/items:batch", response_model=CartSchema)
+async def batch_update_cart(
+    payload: CartBatchUpdate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    """
+    Применяет набор операций add/set/remove к корзине одним запросом и возвращает корзину.
+    """
+    user_id = current_user.id
+    actions = _collapse_operations(payload)
+    if STOCK_RESERVATIONS:
+        removed_ids = [product_id for product_id, (op, _) in actions.items() if op == "remove"]
+        if removed_ids:
+            await release_reservations(db, user_id, removed_ids)
+    await cart_store.apply(db, user_id, actions, reserve=_reserve_hook(db, user_id))
+    if STOCK_RESERVATIONS:
+        await db.commit()
+    return await cart_store.get_cart(db, user_id)
 
 
 @router.put("/items/{product_id}", response_model=CartItemSchema)
@@ -107,16 +110,12 @@ async def update_cart_item(
     db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user),
 ):
-    await _ensure_product_available(db, product_id)
-
-    cart_item = await _get_cart_item(db, current_user.id, product_id)
-    if not cart_item:
-        raise HTTPException(status_code=404, detail="Cart item not found")
-
-    cart_item.quantity = payload.quantity
-    await db.commit()
-    updated_item = await _get_cart_item(db, current_user.id, product_id)
-    return updated_item
+    cart_item = await cart_store.set_quantity(
+        db, current_user.id, product_id, payload.quantity, reserve=_reserve_hook(db, current_user.id)
+    )
+    if STOCK_RESERVATIONS:
+        await db.commit()
+    return cart_item
 
 
 @router.delete("/items/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -125,12 +124,11 @@ async def remove_item_from_cart(
     db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user),
 ):
-    cart_item = await _get_cart_item(db, current_user.id, product_id)
-    if not cart_item:
-        raise HTTPException(status_code=404, detail="Cart item not found")
-
-    await db.delete(cart_item)
-    await db.commit()
+    if STOCK_RESERVATIONS:
+        await release_reservations(db, current_user.id, [product_id])
+    await cart_store.remove_item(db, current_user.id, product_id)
+    if STOCK_RESERVATIONS:
+        await db.commit()
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
@@ -139,6 +137,9 @@ async def clear_cart(
     db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user),
 ):
-    await db.execute(delete(CartItemModel).where(CartItemModel.user_id == current_user.id))
-    await db.commit()
+    if STOCK_RESERVATIONS:
+        await release_reservations(db, current_user.id)
+    await cart_store.clear(db, current_user.id)
+    if STOCK_RESERVATIONS:
+        await db.commit()
     return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -1,8 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from sqlalchemy import select, update, insert
 
+from app.cache import etag_matches, product_cache
+from app.category_tree import category_tree
 from app.models.categories import Category as CategoryModel
-from app.schemas import Category as CategorySchema, CategoryCreate
+from app.models.products import Product as ProductModel
+from app.schemas import Category as CategorySchema, CategoryCreate, CategoryTreeNode
 from app.db_depends import get_async_db
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -14,13 +17,27 @@ router = APIRouter(
 
 
 @router.get("/", response_model=list[CategorySchema])
-async def get_all_categories(db: AsyncSession = Depends(get_async_db)):
+async def get_all_categories(request: Request, db: AsyncSession = Depends(get_async_db)):
     """
-    Возвращает список всех активных категорий.
+    Возвращает список всех активных категорий (из дерева категорий в памяти).
     """
-    result = await db.scalars(select(CategoryModel).where(CategoryModel.is_active==True))
-    categories = result.all()
-    return categories
+    await category_tree.ensure_fresh(db)
+    headers = {"ETag": category_tree.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), category_tree.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=category_tree.categories_body, media_type="application/json", headers=headers)
+
+
+@router.get("/tree", response_model=list[CategoryTreeNode])
+async def get_category_tree(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    Возвращает дерево активных категорий с количеством товаров.
+    """
+    await category_tree.ensure_fresh(db)
+    headers = {"ETag": category_tree.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), category_tree.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=category_tree.tree_body, media_type="application/json", headers=headers)
 
 
 @router.post("/", response_model=CategorySchema, status_code=status.HTTP_201_CREATED)
@@ -44,6 +61,7 @@ async def create_category(category: CategoryCreate, db: AsyncSession = Depends(g
     db.add(db_category)
     await db.commit()
     await db.refresh(db_category)
+    await category_tree.invalidate(db)
     return db_category
 
 
@@ -79,6 +97,7 @@ async def update_category(category_id: int, category: CategoryCreate, db: AsyncS
         .values(**update_data)
     )
     await db.commit()
+    await category_tree.invalidate(db)
     return db_category
 
 
@@ -99,7 +118,13 @@ async def delete_category(category_id: int, db: AsyncSession = Depends(get_async
         .where(CategoryModel.id == category_id)
         .values(is_active=False)
     )
+    product_ids = (await db.scalars(
+        select(ProductModel.id).where(ProductModel.category_id == category_id)
+    )).all()
     await db.commit()
+    await category_tree.invalidate(db)
+    # Карточки товаров категории теперь отвечают 400 — кэшированные копии устарели
+    await product_cache.invalidate(*product_ids)
     return db_category
 
 
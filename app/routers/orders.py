@@ -1,16 +1,29 @@
+import logging
+from datetime import datetime
 from decimal import Decimal
+from typing import Literal
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy import delete, func, select
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from sqlalchemy import Integer, column, delete, func, insert, select, true, tuple_, update, values
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
 from app.auth import get_current_user
+from app.cache import product_cache
+from app.cart_store import cart_store
+from app.config import STOCK_RESERVATIONS
 from app.db_depends import get_async_db
+from app.idempotency import IDEMPOTENCY_HEADER, claim_idempotency_key, store_idempotent_response
 from app.models.cart_items import CartItem as CartItemModel
 from app.models.orders import Order as OrderModel, OrderItem as OrderItemModel
+from app.models.products import Product as ProductModel
 from app.models.users import User as UserModel
-from app.schemas import Order as OrderSchema, OrderList
+from app.outbox import add_event
+from app.reservations import release_reservations, reserved_by_others
+from app.pagination import decode_cursor, encode_cursor
+from app.schemas import Order as OrderSchema, OrderList, OrderSummaryList
+
+logger = logging.getLogger("app.orders")
 
 router = APIRouter(
     prefix="/orders",
@@ -29,8 +42,34 @@ async def _load_order_with_items(db: AsyncSession, order_id: int) -> OrderModel
     return result.first()
 
 
+async def _raise_checkout_error(db: AsyncSession, cart_rows, reserved_ids: set[int]) -> None:
+    """
+    Определяет, почему товар не удалось списать, и возвращает ту же ошибку, что и раньше.
+    """
+    failed_ids = [row.product_id for row in cart_rows if row.product_id not in reserved_ids]
+    products = {
+        product.id: product
+        for product in (await db.scalars(select(ProductModel).where(ProductModel.id.in_(failed_ids)))).all()
+    }
+    product_id = failed_ids[0]
+    product = products.get(product_id)
+    if not product or not product.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Product {product_id} is unavailable",
+        )
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Not enough stock for product {product.name}",
+    )
+
+
 @router.post("/checkout", response_model=OrderSchema, status_code=status.HTTP_201_CREATED)
 async def checkout_order(
+    idempotency_key: str | None = Header(
+        None, alias=IDEMPOTENCY_HEADER, min_length=1, max_length=255,
+        description="Повтор запроса с тем же ключом вернёт уже созданный заказ",
+    ),
     db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user),
 ):
@@ -38,90 +77,164 @@ async def checkout_order(
     Создаёт заказ на основе текущей корзины пользователя.
     Сохраняет позиции заказа, вычитает остатки и очищает корзину.
     """
-    cart_result = await db.scalars(
-        select(CartItemModel)
-        .options(selectinload(CartItemModel.product))
-        .where(CartItemModel.user_id == current_user.id)
-        .order_by(CartItemModel.id)
-    )
-    cart_items = cart_result.all()
-    if not cart_items:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cart is empty")
-
-    order = OrderModel(user_id=current_user.id)
-    total_amount = Decimal("0")
-
-    for cart_item in cart_items:
-        product = cart_item.product
-        if not product or not product.is_active:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Product {cart_item.product_id} is unavailable",
-            )
-        if product.stock < cart_item.quantity:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Not enough stock for product {product.name}",
-            )
-
-        unit_price = product.price
-        if unit_price is None:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Product {product.name} has no price set",
+    user_id = current_user.id  # после rollback объекты сессии истекают
+    if idempotency_key:
+        # Ключ занимается первым запросом транзакции: повтор не трогает ни корзину, ни остатки
+        replay = await claim_idempotency_key(db, user_id, idempotency_key)
+        if replay is not None:
+            return replay
+
+    snapshot = await cart_store.snapshot(db, user_id)
+    cart_rows = snapshot.lines
+    try:
+        if not cart_rows:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cart is empty")
+
+        # Списываем остатки всей корзины одним условным UPDATE ... FROM (VALUES ...).
+        # Строки товаров блокируются в порядке id, поэтому параллельные checkout не
+        # взаимоблокируются, а условие stock >= quantity перепроверяется после блокировки.
+        # FOR NO KEY UPDATE не мешает вставкам, которые ссылаются на товар по внешнему ключу
+        # (позиции корзин и заказов берут лишь FOR KEY SHARE).
+        requested = values(
+            column("product_id", Integer), column("quantity", Integer), name="requested"
+        ).data([(row.product_id, row.quantity) for row in cart_rows])
+        locked = (
+            select(ProductModel.id)
+            .where(ProductModel.id.in_([row.product_id for row in cart_rows]))
+            .order_by(ProductModel.id)
+            .with_for_update(key_share=True)
+            .cte("locked")
+        )
+        available_stock = ProductModel.stock
+        if STOCK_RESERVATIONS:
+            # Чужие активные резервы недоступны; свой резерв заказ использует
+            available_stock = ProductModel.stock - reserved_by_others(ProductModel.id, user_id)
+        reserve_stmt = (
+            update(ProductModel)
+            .where(
+                ProductModel.id == locked.c.id,
+                ProductModel.id == requested.c.product_id,
+                ProductModel.is_active == True,
+                available_stock >= requested.c.quantity,
             )
-        total_price = unit_price * cart_item.quantity
-        total_amount += total_price
-
-        order_item = OrderItemModel(
-            product_id=cart_item.product_id,
-            quantity=cart_item.quantity,
-            unit_price=unit_price,
-            total_price=total_price,
+            .values(stock=ProductModel.stock - requested.c.quantity)
+            .returning(ProductModel.id, ProductModel.price)
+            .execution_options(synchronize_session=False)
         )
-        order.items.append(order_item)
-
-        product.stock -= cart_item.quantity
-
-    order.total_amount = total_amount
-    db.add(order)
-
-    await db.execute(delete(CartItemModel).where(CartItemModel.user_id == current_user.id))
-    await db.commit()
-
-    created_order = await _load_order_with_items(db, order.id)
-    if not created_order:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to load created order",
+        prices = {row.id: row.price for row in (await db.execute(reserve_stmt)).all()}
+        if len(prices) < len(cart_rows):
+            await db.rollback()
+            await _raise_checkout_error(db, cart_rows, set(prices))
+
+        order_items = [
+            {
+                "product_id": row.product_id,
+                "quantity": row.quantity,
+                "unit_price": prices[row.product_id],
+                "total_price": prices[row.product_id] * row.quantity,
+            }
+            for row in cart_rows
+        ]
+        total_amount = sum((item["total_price"] for item in order_items), Decimal("0"))
+
+        order_id = await db.scalar(
+            insert(OrderModel).values(user_id=user_id, total_amount=total_amount).returning(OrderModel.id)
         )
+        await db.execute(insert(OrderItemModel), [{**item, "order_id": order_id} for item in order_items])
+        # Сохранённую копию корзины чистим в той же транзакции, что и заказ
+        await db.execute(delete(CartItemModel).where(CartItemModel.user_id == user_id))
+        if STOCK_RESERVATIONS:
+            await release_reservations(db, user_id, list(prices))
+
+        created_order = await _load_order_with_items(db, order_id)
+        if not created_order:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to load created order",
+            )
+        # Побочные эффекты (уведомления, аналитика) выполнит воркер outbox после фиксации
+        await add_event(db, "order.created", {
+            "order_id": order_id,
+            "user_id": user_id,
+            "total_amount": str(total_amount),
+            "items": [{"product_id": row.product_id, "quantity": row.quantity} for row in cart_rows],
+        })
+        if idempotency_key:
+            body = OrderSchema.model_validate(created_order).model_dump_json()
+            await store_idempotent_response(db, user_id, idempotency_key, status.HTTP_201_CREATED, body)
+        await db.commit()
+    except BaseException:
+        # Заказ не оформлен — корзина снова доступна для checkout
+        await cart_store.release(user_id, snapshot)
+        raise
+    try:
+        await cart_store.consume(user_id, snapshot)
+    except Exception:
+        # Заказ уже зафиксирован: ответ должен дойти до клиента, иначе повтор создаст дубль.
+        # Оплаченные позиции останутся в корзине, а блокировка checkout истечёт по lease
+        logger.exception("Failed to consume cart of user %d after order %d", user_id, order_id)
+    # Остатки товаров изменились — карточки в кэше устарели
+    await product_cache.invalidate(*prices)
     return created_order
 
 
-@router.get("/", response_model=OrderList)
+@router.get("/", response_model=OrderList | OrderSummaryList)
 async def list_orders(
     page: int = Query(1, ge=1),
     page_size: int = Query(10, ge=1, le=100),
+    after: str | None = Query(None, description="Курсор следующей страницы (next_cursor из предыдущего ответа)"),
+    view: Literal["full", "summary"] = Query("full", description="summary — без позиций, с их количеством"),
     db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user),
 ):
     """
-    Возвращает заказы текущего пользователя с простой пагинацией.
+    Возвращает заказы текущего пользователя, новые первыми.
+    Курсорный режим (after) идёт по индексу (user_id, created_at, id) вместо OFFSET.
     """
     total = await db.scalar(
         select(func.count(OrderModel.id)).where(OrderModel.user_id == current_user.id)
     )
-    result = await db.scalars(
-        select(OrderModel)
-        .options(selectinload(OrderModel.items).selectinload(OrderItemModel.product))
+    if view == "summary":
+        items_stats = (
+            select(
+                func.count(OrderItemModel.id).label("items_count"),
+                func.coalesce(func.sum(OrderItemModel.quantity), 0).label("total_quantity"),
+            )
+            .where(OrderItemModel.order_id == OrderModel.id)
+            .lateral("items_stats")
+        )
+        orders_stmt = (
+            select(OrderModel.__table__, items_stats.c.items_count, items_stats.c.total_quantity)
+            .join(items_stats, true())
+        )
+    else:
+        orders_stmt = select(OrderModel).options(
+            selectinload(OrderModel.items).selectinload(OrderItemModel.product)
+        )
+    orders_stmt = (
+        orders_stmt
         .where(OrderModel.user_id == current_user.id)
-        .order_by(OrderModel.created_at.desc())
-        .offset((page - 1) * page_size)
-        .limit(page_size)
+        .order_by(OrderModel.created_at.desc(), OrderModel.id.desc())
     )
-    orders = result.all()
-
-    return OrderList(items=orders, total=total or 0, page=page, page_size=page_size)
+    if after:
+        cursor = decode_cursor(after, created_at=datetime.fromisoformat, id=int)
+        orders_stmt = orders_stmt.where(
+            tuple_(OrderModel.created_at, OrderModel.id) < (cursor["created_at"], cursor["id"])
+        )
+    else:
+        orders_stmt = orders_stmt.offset((page - 1) * page_size)
+    # Берём на одну запись больше, чтобы узнать, есть ли следующая страница
+    result = await db.execute(orders_stmt.limit(page_size + 1))
+    rows = result.all()
+    has_more = len(rows) > page_size
+    orders = [row if view == "summary" else row[0] for row in rows[:page_size]]
+
+    next_cursor = None
+    if has_more:
+        last = orders[-1]
+        next_cursor = encode_cursor(created_at=last.created_at.isoformat(), id=last.id)
+    list_schema = OrderSummaryList if view == "summary" else OrderList
+    return list_schema(items=orders, total=total or 0, page=page, page_size=page_size, next_cursor=next_cursor)
 
 
 @router.get("/{order_id}", response_model=OrderSchema)
@@ -1,25 +1,54 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy import select, update, func, desc
+import csv
+import io
+import json
+from collections.abc import AsyncIterator
+from typing import BinaryIO, Literal
+
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, insert, update, func, desc, case, tuple_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from pydantic import TypeAdapter, ValidationError
+from starlette.concurrency import run_in_threadpool
 
 from app.models.products import Product as ProductModel
 from app.models.categories import Category as CategoryModel
-from app.schemas import Product as ProductSchema, ProductCreate, ProductList
+from app.schemas import Product as ProductSchema, ProductCreate, ProductList, ProductFacets, ProductPage
+from app.schemas import ProductSuggestion, ProductImportReport
 from app.db_depends import get_async_db
+from app.database import async_session_maker
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models.users import User as UserModel
 from app.auth import get_current_seller
-
+from app.pagination import encode_cursor, decode_cursor
+from app.cache import LRUCache, etag_matches, product_cache
+from app.images import MEDIA_ROOT, MEDIA_URL, has_all_variants, schedule_variants, sync_variants_ready
+from app.media_gc import schedule_image_cleanup
+
+import hashlib
+import os
+import tempfile
 from pathlib import Path
-import uuid
 from fastapi import UploadFile, File, Form, HTTPException, status
 
 
-BASE_DIR = Path(__file__).resolve().parent.parent.parent
-MEDIA_ROOT = BASE_DIR / "media" / "products"
-MEDIA_ROOT.mkdir(parents=True, exist_ok=True)
-ALLOWED_IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp"}
+ALLOWED_IMAGE_TYPES = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp"}  # тип -> расширение
 MAX_IMAGE_SIZE = 2 * 1024 * 1024  # 2 097 152 байт
+UPLOAD_CHUNK_SIZE = 256 * 1024
+PRICE_FACET_BOUNDS = (500, 1000, 5000, 10000)  # границы ценовых диапазонов фасетов, руб.
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FIELDS = [name for name, field in ProductSchema.model_fields.items() if not field.exclude]
+IMPORT_BATCH_SIZE = 1000
+MAX_IMPORT_ROWS = 100_000
+
+# total по нормализованному набору фильтров; сбрасывается при любой записи товара
+product_count_cache = LRUCache(maxsize=1024, ttl=60)
+# Готовые ответы автодополнения для горячих префиксов; при записи товаров не сбрасываются —
+# подсказки устаревают не больше чем на ttl
+suggest_cache = LRUCache(maxsize=4096, ttl=30)
+_suggestions_adapter = TypeAdapter(list[ProductSuggestion])
 
 
 # Создаём маршрутизатор для товаров
@@ -29,79 +58,339 @@ router = APIRouter(
 )
 
 
-@router.get("/", response_model=ProductList)
-async def get_all_products(
-        page: int = Query(1, ge=1),
-        page_size: int = Query(20, ge=1, le=100),
-        category_id: int | None = Query(None, description="ID категории для фильтрации"),
-        search: str | None = Query(None, min_length=1, description="Поиск по названию/описанию"),
-        min_price: float | None = Query(None, ge=0, description="Минимальная цена товара"),
-        max_price: float | None = Query(None, ge=0, description="Максимальная цена товара"),
-        in_stock: bool | None = Query(None, description="true — только товары в наличии, false — только без остатка"),
-        seller_id: int | None = Query(None, description="ID продавца для фильтрации"),
-        db: AsyncSession = Depends(get_async_db),
-):
-    if min_price is not None and max_price is not None and min_price > max_price:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="min_price не может быть больше max_price",
+class ProductFilters:
+    """
+    Общие фильтры списка товаров (query-параметры).
+    """
+
+    def __init__(
+            self,
+            category_id: int | None = Query(None, description="ID категории для фильтрации"),
+            search: str | None = Query(None, min_length=1, description="Поиск по названию/описанию"),
+            min_price: float | None = Query(None, ge=0, description="Минимальная цена товара"),
+            max_price: float | None = Query(None, ge=0, description="Максимальная цена товара"),
+            in_stock: bool | None = Query(None, description="true — только товары в наличии, false — только без остатка"),
+            seller_id: int | None = Query(None, description="ID продавца для фильтрации"),
+    ):
+        if min_price is not None and max_price is not None and min_price > max_price:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="min_price не может быть больше max_price",
+            )
+        self.category_id = category_id
+        self.search = search.strip() if search and search.strip() else None
+        self.min_price = min_price
+        self.max_price = max_price
+        self.in_stock = in_stock
+        self.seller_id = seller_id
+
+    def ts_query(self):
+        if self.search is None:
+            return None
+        return func.websearch_to_tsquery('english', self.search)
+
+    def clauses(self) -> list:
+        filters = [ProductModel.is_active.is_(True)]
+
+        if self.category_id is not None:
+            filters.append(ProductModel.category_id == self.category_id)
+        if self.min_price is not None:
+            filters.append(ProductModel.price >= self.min_price)
+        if self.max_price is not None:
+            filters.append(ProductModel.price <= self.max_price)
+        if self.in_stock is not None:
+            filters.append(ProductModel.stock > 0 if self.in_stock else ProductModel.stock == 0)
+        if self.seller_id is not None:
+            filters.append(ProductModel.seller_id == self.seller_id)
+        if self.search is not None:
+            filters.append(ProductModel.tsv.op('@@')(self.ts_query()))
+        return filters
+
+    def cache_key(self) -> tuple:
+        """
+        Нормализованный набор фильтров — ключ для кэша количества товаров.
+        """
+        return (
+            self.category_id,
+            self.search.lower() if self.search else None,
+            self.min_price,
+            self.max_price,
+            self.in_stock,
+            self.seller_id,
         )
 
-    filters = [ProductModel.is_active.is_(True)]
 
-    if category_id is not None:
-        filters.append(ProductModel.category_id == category_id)
-    if min_price is not None:
-        filters.append(ProductModel.price >= min_price)
-    if max_price is not None:
-        filters.append(ProductModel.price <= max_price)
-    if in_stock is not None:
-        filters.append(ProductModel.stock > 0 if in_stock else ProductModel.stock == 0)
-    if seller_id is not None:
-        filters.append(ProductModel.seller_id == seller_id)
+class _Explain(Executable, ClauseElement):
+    """
+    EXPLAIN (FORMAT JSON) над произвольным SELECT с обычными bind-параметрами.
+    """
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
 
-    rank_col = None
-    if search:
-        search_value = search.strip()
-        if search_value:
-            ts_query = func.websearch_to_tsquery('english', search_value)
-            filters.append(ProductModel.tsv.op('@@')(ts_query))
-            rank_col = func.ts_rank_cd(ProductModel.tsv, ts_query).label("rank")
-
-    total_stmt = select(func.count()).select_from(ProductModel).where(*filters)
+
+@compiles(_Explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+async def _estimate_count(db: AsyncSession, stmt) -> int:
+    """
+    Возвращает оценку количества строк из плана запроса, не выполняя сам запрос.
+    """
+    plan = await db.scalar(_Explain(stmt))
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+async def _count_products(db: AsyncSession, filters: ProductFilters, strategy: str) -> int:
+    if strategy == "estimated":
+        return await _estimate_count(db, select(ProductModel.id).where(*filters.clauses()))
+
+    if strategy == "cached":
+        total = product_count_cache.get(filters.cache_key())
+        if total is not None:
+            return total
+
+    total_stmt = select(func.count()).select_from(ProductModel).where(*filters.clauses())
     total = await db.scalar(total_stmt) or 0
+    if strategy == "cached":
+        product_count_cache.set(filters.cache_key(), total)
+    return total
+
+
+async def _fetch_product_page(
+        db: AsyncSession,
+        filters: ProductFilters,
+        page: int,
+        page_size: int,
+        after: str | None,
+) -> tuple[list[ProductModel], str | None]:
+    """
+    Возвращает страницу товаров и курсор следующей страницы (или None).
+    """
+    rank_col = None
+    ts_query = filters.ts_query()
+    if ts_query is not None:
+        rank_col = func.ts_rank_cd(ProductModel.tsv, ts_query).label("rank")
 
-    # Основной запрос (если есть поиск — добавим ранг в выборку и сортировку)
+    # Курсорный режим (after) ищет по ключу сортировки вместо OFFSET,
+    # поэтому глубокие страницы стоят столько же, сколько первая
     if rank_col is not None:
         products_stmt = (
             select(ProductModel, rank_col)
-            .where(*filters)
+            .where(*filters.clauses())
             .order_by(desc(rank_col), ProductModel.id)
-            .offset((page - 1) * page_size)
-            .limit(page_size)
         )
-        result = await db.execute(products_stmt)
-        rows = result.all()
-        items = [row[0] for row in rows]    # сами объекты
-        # при желании можно вернуть ранг в ответе
-        # ranks = [row.rank for row in rows]
+        if after:
+            cursor = decode_cursor(after, rank=float, id=int)
+            products_stmt = products_stmt.where(
+                (rank_col < cursor["rank"])
+                | ((rank_col == cursor["rank"]) & (ProductModel.id > cursor["id"]))
+            )
     else:
         products_stmt = (
             select(ProductModel)
-            .where(*filters)
+            .where(*filters.clauses())
             .order_by(ProductModel.id)
-            .offset((page - 1) * page_size)
-            .limit(page_size)
         )
-        items = (await db.scalars(products_stmt)).all()
+        if after:
+            cursor = decode_cursor(after, id=int)
+            products_stmt = products_stmt.where(ProductModel.id > cursor["id"])
+
+    if not after:
+        products_stmt = products_stmt.offset((page - 1) * page_size)
+    # Берём на одну запись больше, чтобы узнать, есть ли следующая страница
+    result = await db.execute(products_stmt.limit(page_size + 1))
+    rows = result.all()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    items = [row[0] for row in rows]    # сами объекты
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        if rank_col is not None:
+            next_cursor = encode_cursor(rank=last.rank, id=last[0].id)
+        else:
+            next_cursor = encode_cursor(id=last[0].id)
+    return items, next_cursor
+
+
+@router.get("/", response_model=ProductList)
+async def get_all_products(
+        page: int = Query(1, ge=1),
+        page_size: int = Query(20, ge=1, le=100),
+        after: str | None = Query(None, description="Курсор следующей страницы (next_cursor из предыдущего ответа)"),
+        count: Literal["exact", "cached", "estimated"] = Query(
+            "exact", description="Способ подсчёта total: точный, из кэша или оценка планировщика"),
+        filters: ProductFilters = Depends(),
+        db: AsyncSession = Depends(get_async_db),
+):
+    total = await _count_products(db, filters, count)
+    items, next_cursor = await _fetch_product_page(db, filters, page, page_size, after)
 
     return {
         "items": items,
         "total": total,
         "page": page,
         "page_size": page_size,
+        "next_cursor": next_cursor,
+        "total_strategy": count,
     }
 
+
+@router.get("/facets", response_model=ProductFacets)
+async def get_product_facets(
+        page: int = Query(1, ge=1),
+        page_size: int = Query(20, ge=1, le=100),
+        after: str | None = Query(None, description="Курсор следующей страницы (next_cursor из предыдущего ответа)"),
+        filters: ProductFilters = Depends(),
+        db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Возвращает страницу товаров вместе со счётчиками по категориям, продавцам,
+    ценовым диапазонам и наличию. Все счётчики считаются одним запросом (GROUPING SETS).
+    """
+    price_bucket = case(
+        *[(ProductModel.price < bound, index) for index, bound in enumerate(PRICE_FACET_BOUNDS)],
+        else_=len(PRICE_FACET_BOUNDS),
+    ).label("price_bucket")
+    in_stock = (ProductModel.stock > 0).label("in_stock")
+    dimensions = (ProductModel.category_id, ProductModel.seller_id, price_bucket, in_stock)
+
+    facets_stmt = (
+        select(
+            *dimensions,
+            func.grouping(*dimensions).label("grouping_id"),
+            func.count().label("products_count"),
+        )
+        .where(*filters.clauses())
+        .group_by(func.grouping_sets(*[tuple_(dimension) for dimension in dimensions], tuple_()))
+    )
+    facet_rows = (await db.execute(facets_stmt)).all()
+
+    # grouping() даёт битовую маску: 1 — столбец не входит в текущий набор группировки
+    total = 0
+    categories, sellers, price_ranges = [], [], []
+    stock = {"in_stock": 0, "out_of_stock": 0}
+    for row in facet_rows:
+        if row.grouping_id == 0b0111:
+            categories.append({"value": row.category_id, "count": row.products_count})
+        elif row.grouping_id == 0b1011:
+            sellers.append({"value": row.seller_id, "count": row.products_count})
+        elif row.grouping_id == 0b1101:
+            bounds = (0, *PRICE_FACET_BOUNDS, None)
+            price_ranges.append({
+                "min_price": bounds[row.price_bucket],
+                "max_price": bounds[row.price_bucket + 1],
+                "count": row.products_count,
+            })
+        elif row.grouping_id == 0b1110:
+            stock["in_stock" if row.in_stock else "out_of_stock"] = row.products_count
+        else:
+            total = row.products_count
+
+    items, next_cursor = await _fetch_product_page(db, filters, page, page_size, after)
+
+    return {
+        "items": items,
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "next_cursor": next_cursor,
+        "categories": sorted(categories, key=lambda facet: -facet["count"]),
+        "sellers": sorted(sellers, key=lambda facet: -facet["count"]),
+        "price_ranges": sorted(price_ranges, key=lambda facet: facet["min_price"]),
+        "stock": stock,
+    }
+
+
+@router.get("/suggest", response_model=list[ProductSuggestion])
+async def suggest_products(
+        q: str = Query(..., min_length=1, max_length=100, description="Начало названия товара"),
+        limit: int = Query(10, ge=1, le=20),
+        db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Автодополнение названий товаров: только id и name, горячие префиксы отдаются из памяти.
+    """
+    term = q.strip().lower()
+    if not term:
+        return []
+    cache_key = (term, limit)
+    body = suggest_cache.get(cache_key)
+    if body is None:
+        pattern = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        name = func.lower(ProductModel.name)
+        is_prefix = name.like(f"{pattern}%", escape="\\")
+        stmt = select(ProductModel.id, ProductModel.name).where(ProductModel.is_active == True).limit(limit)
+        if len(term) < 3:
+            # Для коротких строк триграмм нет — только префикс. Порядок совпадает с btree-индексом,
+            # поэтому сканирование останавливается после limit строк
+            stmt = stmt.where(is_prefix).order_by(name.collate("C"), ProductModel.id)
+        else:
+            # Подстрока по триграммному индексу, совпадения с начала названия — первыми
+            stmt = stmt.where(name.like(f"%{pattern}%", escape="\\")).order_by(
+                desc(is_prefix), func.length(ProductModel.name), ProductModel.id
+            )
+
+        rows = (await db.execute(stmt)).all()
+        body = _suggestions_adapter.dump_json([ProductSuggestion(id=row.id, name=row.name) for row in rows])
+        suggest_cache.set(cache_key, body)
+    return Response(content=body, media_type="application/json")
+
+
+async def _export_products(stmt, export_format: str) -> AsyncIterator[str]:
+    """
+    Построчно выгружает товары через серверный курсор пачками по EXPORT_BATCH_SIZE.
+    """
+    # Своя сессия: ответ стримится дольше, чем живёт обработчик запроса
+    async with async_session_maker() as session:
+        result = await session.stream(stmt)
+        if export_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_FIELDS)
+            async for rows in result.partitions():
+                writer.writerows(rows)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        else:
+            async for rows in result.partitions():
+                yield "".join(
+                    ProductSchema.model_validate(row._mapping).model_dump_json() + "\n" for row in rows
+                )
+
+
+@router.get("/export")
+async def export_products(
+        export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format", description="Формат выгрузки"),
+        filters: ProductFilters = Depends(),
+):
+    """
+    Потоково выгружает все активные товары (с теми же фильтрами, что и список) в NDJSON или CSV.
+    Память не зависит от размера каталога.
+    """
+    stmt = (
+        # Для NDJSON нужен ещё флаг вариантов изображения: по нему строится image_variants
+        select(*[getattr(ProductModel, field) for field in EXPORT_FIELDS],
+               *([ProductModel.image_variants_ready] if export_format == "ndjson" else []))
+        .where(*filters.clauses())
+        .order_by(ProductModel.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _export_products(stmt, export_format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="products.{export_format}"'},
+    )
+
+
 @router.post("/", response_model=ProductSchema, status_code=status.HTTP_201_CREATED)
 async def create_product(
         product: ProductCreate = Depends(ProductCreate.as_form),
@@ -130,14 +419,105 @@ async def create_product(
 
     db.add(db_product)
     await db.commit()
+    product_count_cache.clear()
+    await sync_variants_ready(image_url)
     await db.refresh(db_product)  # Для получения id и is_active из базы
     return db_product
 
 
-@router.get("/category/{category_id}", response_model=list[ProductSchema])
-async def get_products_by_category(category_id: int, db: AsyncSession = Depends(get_async_db)):
+def _parse_import_file(file: BinaryIO, import_format: str) -> tuple[list[tuple[int, ProductCreate]], list[dict]]:
+    """
+    Читает загруженный файл построчно и валидирует строки через ProductCreate.
+    Возвращает валидные строки с их номерами и отчёт об ошибках.
+    """
+    stream = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    if import_format == "csv":
+        records = enumerate((
+            {key: (value if value != "" else None) for key, value in record.items()}
+            for record in csv.DictReader(stream)
+        ), start=1)
+    else:
+        # Номер строки считаем до пропуска пустых — в отчёте он совпадает со строкой файла
+        records = ((line_number, line) for line_number, line in enumerate(stream, start=1) if line.strip())
+
+    valid, errors = [], []
+    try:
+        for count, (row_number, record) in enumerate(records, start=1):
+            if count > MAX_IMPORT_ROWS:
+                raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Import is limited to {MAX_IMPORT_ROWS} rows")
+            try:
+                if isinstance(record, str):
+                    valid.append((row_number, ProductCreate.model_validate_json(record)))
+                else:
+                    valid.append((row_number, ProductCreate.model_validate(record)))
+            except ValidationError as ex:
+                errors.append({
+                    "row": row_number,
+                    "errors": [f"{'.'.join(map(str, error['loc'])) or 'row'}: {error['msg']}" for error in ex.errors()],
+                })
+    except UnicodeDecodeError:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Import file must be UTF-8 encoded")
+    finally:
+        stream.detach()  # сам файл закроет UploadFile
+    return valid, errors
+
+
+@router.post("/import", response_model=ProductImportReport)
+async def import_products(
+        file: UploadFile = File(..., description="CSV с заголовком или NDJSON (по объекту товара в строке)"),
+        db: AsyncSession = Depends(get_async_db),
+        current_user: UserModel = Depends(get_current_seller),
+):
     """
-    Возвращает список активных товаров в указанной категории по её ID.
+    Массово создаёт товары текущего продавца из CSV/NDJSON (только для 'seller').
+    Невалидные строки пропускаются и попадают в отчёт.
+    """
+    filename = (file.filename or "").lower()
+    import_format = "csv" if filename.endswith(".csv") or file.content_type == "text/csv" else "ndjson"
+
+    # Разбор и валидация — CPU-работа, выносим из event loop
+    valid, errors = await run_in_threadpool(_parse_import_file, file.file, import_format)
+
+    # Все категории из файла — одним запросом
+    category_ids = {product.category_id for _, product in valid}
+    active_category_ids = set()
+    if category_ids:
+        active_category_ids = set((await db.scalars(
+            select(CategoryModel.id).where(CategoryModel.id.in_(category_ids), CategoryModel.is_active == True)
+        )).all())
+
+    rows = []
+    for row_number, product in valid:
+        if product.category_id not in active_category_ids:
+            errors.append({"row": row_number, "errors": ["category_id: Category not found or inactive"]})
+            continue
+        rows.append({**product.model_dump(), "seller_id": current_user.id, "is_active": True})
+
+    # executemany без RETURNING: asyncpg выполняет подготовленный INSERT для каждой строки пачки
+    # конвейером, без ожидания ответа на каждую (это не многострочный INSERT ... VALUES)
+    for start in range(0, len(rows), IMPORT_BATCH_SIZE):
+        await db.execute(insert(ProductModel), rows[start:start + IMPORT_BATCH_SIZE])
+    await db.commit()
+    if rows:
+        product_count_cache.clear()
+
+    return {
+        "created": len(rows),
+        "failed": len(errors),
+        "errors": sorted(errors, key=lambda error: error["row"]),
+    }
+
+
+@router.get("/category/{category_id}", response_model=ProductPage)
+async def get_products_by_category(
+        category_id: int,
+        page_size: int = Query(20, ge=1, le=100),
+        after: str | None = Query(None, description="Курсор следующей страницы (next_cursor из предыдущего ответа)"),
+        db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Возвращает активные товары категории и всех её активных подкатегорий,
+    постранично с курсором (after).
     """
     # Проверяем, существует ли активная категория
     result = await db.scalars(
@@ -149,37 +529,72 @@ async def get_products_by_category(category_id: int, db: AsyncSession = Depends(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Category not found or inactive")
 
-    # Получаем активные товары в категории
-    product_result = await db.scalars(
-        select(ProductModel).where(ProductModel.category_id == category_id, ProductModel.is_active == True)
+    # Всё поддерево одним рекурсивным CTE; UNION (а не UNION ALL) защищает от циклов в parent_id
+    subtree = (
+        select(CategoryModel.id)
+        .where(CategoryModel.id == category_id)
+        .cte("category_subtree", recursive=True)
+    )
+    subtree = subtree.union(
+        select(CategoryModel.id)
+        .join(subtree, CategoryModel.parent_id == subtree.c.id)
+        .where(CategoryModel.is_active == True)
+    )
+
+    products_stmt = (
+        select(ProductModel)
+        .where(ProductModel.category_id.in_(select(subtree.c.id)), ProductModel.is_active == True)
+        .order_by(ProductModel.id)
+        .limit(page_size + 1)
     )
-    return product_result.all()
+    if after:
+        cursor = decode_cursor(after, id=int)
+        products_stmt = products_stmt.where(ProductModel.id > cursor["id"])
+
+    items = (await db.scalars(products_stmt)).all()
+    next_cursor = encode_cursor(id=items[page_size - 1].id) if len(items) > page_size else None
+
+    return {
+        "items": items[:page_size],
+        "page_size": page_size,
+        "next_cursor": next_cursor,
+    }
 
 
 @router.get("/{product_id}", response_model=ProductSchema)
-async def get_product(product_id: int, db: AsyncSession = Depends(get_async_db)):
+async def get_product(product_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
     """
     Возвращает детальную информацию о товаре по его ID.
+    Ответ кэшируется; поддерживаются ETag/If-None-Match (304 без обращения к БД).
     """
-    # Проверяем, существует ли активный товар
-    product_result = await db.scalars(
-        select(ProductModel).where(ProductModel.id == product_id, ProductModel.is_active == True)
-    )
-    product = product_result.first()
-    if not product:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found or inactive")
-
-    # Проверяем, существует ли активная категория
-    category_result = await db.scalars(
-        select(CategoryModel).where(CategoryModel.id == product.category_id,
-                                    CategoryModel.is_active == True)
-    )
-    category = category_result.first()
-    if not category:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail="Category not found or inactive")
-
-    return product
+    entry = await product_cache.get(product_id)
+    if entry is None:
+        generation = await product_cache.generation(product_id)
+        # Товар и активность его категории одним запросом
+        result = await db.execute(
+            select(ProductModel, CategoryModel.is_active)
+            .outerjoin(CategoryModel, CategoryModel.id == ProductModel.category_id)
+            .where(ProductModel.id == product_id, ProductModel.is_active == True)
+        )
+        row = result.first()
+        if not row:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found or inactive")
+        product, category_is_active = row
+        if not category_is_active:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="Category not found or inactive")
+
+        entry = product_cache.make_entry(ProductSchema.model_validate(product).model_dump_json())
+        await product_cache.set(product_id, entry, generation)
+
+    headers = {
+        "ETag": entry["etag"],
+        "Last-Modified": entry["last_modified"],
+        "Cache-Control": "no-cache",
+    }
+    if etag_matches(request.headers.get("if-none-match"), entry["etag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=entry["body"], media_type="application/json", headers=headers)
 
 
 @router.put("/{product_id}", response_model=ProductSchema)
@@ -212,11 +627,18 @@ async def update_product(
         update(ProductModel).where(ProductModel.id == product_id).values(**product.model_dump())
     )
 
+    old_image_url = db_product.image_url
     if image:
-        remove_product_image(db_product.image_url)
         db_product.image_url = await save_product_image(image)
+        db_product.image_variants_ready = False
 
     await db.commit()
+    product_count_cache.clear()
+    if image:
+        await sync_variants_ready(db_product.image_url)
+    await product_cache.invalidate(product_id)
+    if db_product.image_url != old_image_url:
+        remove_product_image(old_image_url)
     await db.refresh(db_product)  # Для консистентности данных
     return db_product
 
@@ -240,39 +662,82 @@ async def delete_product(
     await db.execute(
         update(ProductModel).where(ProductModel.id == product_id).values(is_active=False)
     )
-    remove_product_image(product.image_url)
-
     await db.commit()
+    product_count_cache.clear()
+    await product_cache.invalidate(product_id)
+    remove_product_image(product.image_url)
     await db.refresh(product)  # Для возврата is_active = False
     return product
 
 
+def _open_upload_tmp() -> BinaryIO:
+    # Временный файл рядом с итоговым: os.replace в пределах одной ФС атомарен
+    return tempfile.NamedTemporaryFile(dir=MEDIA_ROOT, prefix=".upload-", suffix=".part", delete=False)
+
+
+def _write_upload_chunk(tmp: BinaryIO, digest, chunk: bytes) -> None:
+    digest.update(chunk)
+    tmp.write(chunk)
+
+
+def _commit_upload(tmp: BinaryIO, file_path: Path) -> bool:
+    """
+    Переносит временный файл на место итогового. Возвращает False,
+    если такой же файл уже есть (дубликат) — тогда запись не нужна.
+    """
+    tmp.close()
+    if file_path.exists():
+        Path(tmp.name).unlink(missing_ok=True)
+        os.utime(file_path)  # свежий mtime — файл снова используется
+        return False
+    os.chmod(tmp.name, 0o644)  # NamedTemporaryFile создаётся с правами 0600
+    os.replace(tmp.name, file_path)
+    return True
+
+
+def _discard_upload(tmp: BinaryIO) -> None:
+    tmp.close()
+    Path(tmp.name).unlink(missing_ok=True)
+
+
 async def save_product_image(file: UploadFile) -> str:
     """
     Сохраняет изображение товара и возвращает относительный URL.
+    Файл копируется кусками через пул потоков и не блокирует event loop.
+    Имя файла — SHA-256 содержимого, поэтому одинаковые загрузки делят один файл.
     """
     if file.content_type not in ALLOWED_IMAGE_TYPES:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Only JPG, PNG or WebP images are allowed")
-
-    content = await file.read()
-    if len(content) > MAX_IMAGE_SIZE:
+    if file.size is not None and file.size > MAX_IMAGE_SIZE:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Image is too large")
 
-    extension = Path(file.filename or "").suffix.lower() or ".jpg"
-    file_name = f"{uuid.uuid4()}{extension}"
-    file_path = MEDIA_ROOT / file_name
-    file_path.write_bytes(content)
-
-    return f"/media/products/{file_name}"
+    digest = hashlib.sha256()
+    tmp = await run_in_threadpool(_open_upload_tmp)
+    try:
+        size = 0
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > MAX_IMAGE_SIZE:   # прерываем, не дочитывая остаток
+                raise HTTPException(status.HTTP_400_BAD_REQUEST, "Image is too large")
+            await run_in_threadpool(_write_upload_chunk, tmp, digest, chunk)
+        # Расширение по типу содержимого, а не по имени файла: иначе одинаковые байты не совпадут
+        file_name = f"{digest.hexdigest()}{ALLOWED_IMAGE_TYPES[file.content_type]}"
+        file_path = MEDIA_ROOT / file_name
+        created = await run_in_threadpool(_commit_upload, tmp, file_path)
+    except BaseException:
+        await run_in_threadpool(_discard_upload, tmp)
+        raise
+
+    # Миниатюры и WebP строятся в фоне, в пуле процессов. Для уже сохранённого файла —
+    # только если вариантов не хватает (прошлая генерация могла не завершиться)
+    if created or not await run_in_threadpool(has_all_variants, file_name):
+        schedule_variants(file_path)
+    return f"{MEDIA_URL}/{file_name}"
 
 
 def remove_product_image(url: str | None) -> None:
     """
-    Удаляет файл изображения, если он существует.
+    Передаёт файл изображения фоновому сборщику: он удалит файл и его варианты,
+    когда на них не останется ссылок у активных товаров. Вызывать после коммита.
     """
-    if not url:
-        return
-    relative_path = url.lstrip("/")
-    file_path = BASE_DIR / relative_path
-    if file_path.exists():
-        file_path.unlink()
+    schedule_image_cleanup(url)
@@ -10,6 +10,7 @@ from sqlalchemy.sql import func
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.auth import get_current_buyer, get_current_admin
+from app.cache import product_cache
 
 router = APIRouter(
     prefix="",
@@ -99,6 +100,7 @@ async def create_review(
     await update_product_rating(db, review.product_id)
 
     await db.commit()
+    await product_cache.invalidate(review.product_id)  # рейтинг в карточке изменился
     return new_review
 
 
@@ -128,4 +130,5 @@ async def delete_review(
     await update_product_rating(db, review.product_id)
 
     await db.commit()
+    await product_cache.invalidate(review.product_id)  # рейтинг в карточке изменился
     return {"message": "Review deleted"}
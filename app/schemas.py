@@ -2,10 +2,14 @@ from decimal import Decimal
 from datetime import datetime
 
 from fastapi.exceptions import RequestValidationError
-from pydantic import BaseModel, Field, ConfigDict, EmailStr, SecretStr, ValidationError
-from typing import Annotated
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, SecretStr, ValidationError, computed_field, model_validator
+from typing import Annotated, Literal
 from fastapi import Form
 
+from app.images import variant_urls
+
+INT4_MAX = 2_147_483_647  # предел столбцов Integer в PostgreSQL
+
 class CategoryCreate(BaseModel):
     """
     Модель для создания и обновления категории.
@@ -29,6 +33,18 @@ class Category(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class CategoryTreeNode(BaseModel):
+    """
+    Узел дерева категорий с количеством активных товаров.
+    """
+    id: int = Field(description="Уникальный идентификатор категории")
+    name: str = Field(description="Название категории")
+    parent_id: int | None = Field(None, description="ID родительской категории, если есть")
+    product_count: int = Field(ge=0, description="Товаров непосредственно в категории")
+    total_product_count: int = Field(ge=0, description="Товаров в категории и всех подкатегориях")
+    children: list["CategoryTreeNode"] = Field(default_factory=list, description="Подкатегории")
+
+
 class ProductCreate(BaseModel):
     """
     Модель для создания и обновления товара.
@@ -38,9 +54,10 @@ class ProductCreate(BaseModel):
                       description="Название товара (3-100 символов)")
     description: str | None = Field(None, max_length=500,
                                        description="Описание товара (до 500 символов)")
-    price: Decimal = Field(gt=0, description="Цена товара (больше 0)", decimal_places=2)
-    stock: int = Field(..., ge=0, description="Количество товара на складе (0 или больше)")
-    category_id: int = Field(..., description="ID категории, к которой относится товар")
+    # Пределы совпадают со столбцами Numeric(10, 2) и Integer: иначе вставка падает в БД
+    price: Decimal = Field(gt=0, description="Цена товара (больше 0)", max_digits=10, decimal_places=2)
+    stock: int = Field(..., ge=0, le=INT4_MAX, description="Количество товара на складе (0 или больше)")
+    category_id: int = Field(..., gt=0, le=INT4_MAX, description="ID категории, к которой относится товар")
 
     @classmethod
     def as_form(
@@ -77,9 +94,15 @@ class Product(BaseModel):
     rating: float = Field(description="Рейтинг товара")
     category_id: int = Field(description="ID категории")
     is_active: bool = Field(description="Активность товара")
+    image_variants_ready: bool = Field(False, exclude=True)
 
     model_config = ConfigDict(from_attributes=True)
 
+    @computed_field(description="URL уменьшенных копий изображения: вариант -> формат -> URL")
+    @property
+    def image_variants(self) -> dict[str, dict[str, str]] | None:
+        return variant_urls(self.image_url, self.image_variants_ready)
+
 
 class ProductList(BaseModel):
     """
@@ -89,10 +112,81 @@ class ProductList(BaseModel):
     total: int = Field(ge=0, description="Общее количество товаров")
     page: int = Field(ge=1, description="Номер текущей страницы")
     page_size: int = Field(ge=1, description="Количество элементов на странице")
+    next_cursor: str | None = Field(None, description="Курсор для запроса следующей страницы (after)")
+    total_strategy: str = Field("exact", description="Как получен total: exact, cached или estimated")
 
     model_config = ConfigDict(from_attributes=True)
 
 
+class ProductImportError(BaseModel):
+    """
+    Ошибки одной строки массового импорта.
+    """
+    row: int = Field(ge=1, description="Номер строки данных (с 1, без заголовка)")
+    errors: list[str] = Field(description="Описание ошибок")
+
+
+class ProductImportReport(BaseModel):
+    """
+    Итог массового импорта товаров.
+    """
+    created: int = Field(ge=0, description="Создано товаров")
+    failed: int = Field(ge=0, description="Пропущено строк с ошибками")
+    errors: list[ProductImportError] = Field(default_factory=list, description="Ошибки по строкам")
+
+
+class ProductSuggestion(BaseModel):
+    """
+    Подсказка автодополнения: только ID и название товара.
+    """
+    id: int = Field(description="Уникальный идентификатор товара")
+    name: str = Field(description="Название товара")
+
+
+class ProductPage(BaseModel):
+    """
+    Страница товаров с курсорной пагинацией (без общего количества).
+    """
+    items: list[Product] = Field(description="Товары для текущей страницы")
+    page_size: int = Field(ge=1, description="Количество элементов на странице")
+    next_cursor: str | None = Field(None, description="Курсор для запроса следующей страницы (after)")
+
+
+class FacetCount(BaseModel):
+    """
+    Количество товаров для одного значения фасета (категория или продавец).
+    """
+    value: int = Field(description="ID категории или продавца")
+    count: int = Field(ge=0, description="Количество товаров")
+
+
+class PriceFacet(BaseModel):
+    """
+    Количество товаров в ценовом диапазоне [min_price, max_price).
+    """
+    min_price: float = Field(ge=0, description="Нижняя граница диапазона")
+    max_price: float | None = Field(None, description="Верхняя граница диапазона (None — без ограничения)")
+    count: int = Field(ge=0, description="Количество товаров")
+
+
+class StockFacet(BaseModel):
+    """
+    Количество товаров в наличии и без остатка.
+    """
+    in_stock: int = Field(ge=0, description="Товары в наличии")
+    out_of_stock: int = Field(ge=0, description="Товары без остатка")
+
+
+class ProductFacets(ProductList):
+    """
+    Страница товаров вместе со счётчиками фасетов по тем же фильтрам.
+    """
+    categories: list[FacetCount] = Field(description="Количество товаров по категориям")
+    sellers: list[FacetCount] = Field(description="Количество товаров по продавцам")
+    price_ranges: list[PriceFacet] = Field(description="Количество товаров по ценовым диапазонам")
+    stock: StockFacet = Field(description="Количество товаров по наличию")
+
+
 class UserCreate(BaseModel):
     email: EmailStr = Field(description="Email пользователя")
     password: SecretStr = Field(min_length=8, description="Пароль (минимум 8 символов)")
@@ -148,6 +242,25 @@ class CartItemUpdate(BaseModel):
     quantity: int = Field(..., ge=1, description="Новое количество товара")
 
 
+class CartBatchOperation(BaseModel):
+    """Одна операция пакетного изменения корзины."""
+    op: Literal["add", "set", "remove"] = Field(..., description="add — добавить, set — задать количество, remove — удалить")
+    product_id: int = Field(..., description="ID товара")
+    quantity: int | None = Field(None, ge=1, description="Количество (обязательно для add и set)")
+
+    @model_validator(mode="after")
+    def check_quantity(self):
+        if self.op != "remove" and self.quantity is None:
+            raise ValueError(f"quantity is required for '{self.op}'")
+        return self
+
+
+class CartBatchUpdate(BaseModel):
+    """Модель для пакетного изменения корзины: операции применяются по порядку."""
+    operations: list[CartBatchOperation] = Field(..., min_length=1, max_length=500,
+                                                 description="Список операций")
+
+
 class CartItem(BaseModel):
     """Товар в корзине с данными продукта."""
     id: int = Field(..., description="ID позиции корзины")
@@ -167,6 +280,13 @@ class Cart(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class CartSummary(BaseModel):
+    """Краткая сводка корзины для мини-корзины в шапке сайта."""
+    items_count: int = Field(..., ge=0, description="Количество позиций в корзине")
+    total_quantity: int = Field(..., ge=0, description="Общее количество товаров")
+    total_price: Decimal = Field(..., ge=0, description="Общая стоимость товаров")
+
+
 class OrderItem(BaseModel):
     id: int = Field(..., description="ID позиции заказа")
     product_id: int = Field(..., description="ID товара")
@@ -195,5 +315,25 @@ class OrderList(BaseModel):
     total: int = Field(ge=0, description="Общее количество заказов")
     page: int = Field(ge=1, description="Текущая страница")
     page_size: int = Field(ge=1, description="Размер страницы")
+    next_cursor: str | None = Field(None, description="Курсор для запроса следующей страницы (after)")
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class OrderSummary(BaseModel):
+    """Заголовок заказа без позиций: для списка заказов в режиме view=summary."""
+    id: int = Field(..., description="ID заказа")
+    user_id: int = Field(..., description="ID пользователя")
+    status: str = Field(..., description="Текущий статус заказа")
+    total_amount: Decimal = Field(..., ge=0, description="Общая стоимость")
+    created_at: datetime = Field(..., description="Когда заказ был создан")
+    updated_at: datetime = Field(..., description="Когда последний раз обновлялся")
+    items_count: int = Field(..., ge=0, description="Количество позиций в заказе")
+    total_quantity: int = Field(..., ge=0, description="Общее количество товаров")
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class OrderSummaryList(OrderList):
+    """Список заказов в режиме view=summary."""
+    items: list[OrderSummary] = Field(..., description="Заказы на текущей странице")
@@ -0,0 +1,3 @@
+"""
+Нагрузочные замеры. Запускаются вручную (python -m benchmarks.<скрипт>), в pytest не входят.
+"""
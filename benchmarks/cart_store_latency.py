@@ -0,0 +1,116 @@
+"""
+Латентность операций корзины: SqlCartStore против KeyValueCartStore.
+
+Оба хранилища вызываются напрямую, по сессии на операцию — как в обработчиках /cart.
+CART_USERS покупателей параллельно добавляют товар, читают корзину, меняют количество,
+читают итог и удаляют позицию. Для kv отдельно замеряется перенос изменённых корзин
+в cart_items (flush). Хранилище kv — CART_STORE_URL: redis://... или память процесса.
+
+Нужна база со схемой из миграций (DATABASE_URL). Скрипт создаёт своих пользователей,
+категорию и товары и удаляет их после замера.
+
+    DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.cart_store_latency
+"""
+import asyncio
+import os
+import random
+import time
+import uuid
+from decimal import Decimal
+
+from sqlalchemy import delete
+
+from app.cart_backends import create_cart_backend
+from app.cart_store import CartStore, KeyValueCartStore, SqlCartStore
+from app.config import CART_STORE_URL
+from app.database import async_engine, async_session_maker
+from app.models.cart_items import CartItem as CartItemModel
+from app.models.categories import Category as CategoryModel
+from app.models.products import Product as ProductModel
+from app.models.users import User as UserModel
+from benchmarks.common import summary, timed
+
+DURATION = float(os.getenv("BENCH_DURATION", "10"))
+CART_USERS = int(os.getenv("CART_USERS", "32"))
+PRODUCTS = 200
+OPERATIONS = ("add_item", "get_cart", "set_quantity", "get_summary", "remove_item")
+
+
+async def _create_fixtures() -> tuple[list[int], list[int], int]:
+    tag = uuid.uuid4().hex[:8]
+    async with async_session_maker() as session:
+        seller = UserModel(email=f"bench-seller-{tag}@example.com", hashed_password="-", role="seller")
+        buyers = [
+            UserModel(email=f"bench-buyer-{tag}-{index}@example.com", hashed_password="-", role="buyer")
+            for index in range(CART_USERS)
+        ]
+        category = CategoryModel(name=f"bench-{tag}")
+        session.add_all([seller, category, *buyers])
+        await session.flush()
+        products = [
+            ProductModel(name=f"bench-{tag}-{index}", price=Decimal("100.00"), stock=1_000_000,
+                         category_id=category.id, seller_id=seller.id)
+            for index in range(PRODUCTS)
+        ]
+        session.add_all(products)
+        await session.commit()
+        return [seller.id, *(buyer.id for buyer in buyers)], [product.id for product in products], category.id
+
+
+async def _drop_fixtures(user_ids: list[int], product_ids: list[int], category_id: int) -> None:
+    async with async_session_maker() as session:
+        await session.execute(delete(CartItemModel).where(CartItemModel.user_id.in_(user_ids)))
+        await session.execute(delete(ProductModel).where(ProductModel.id.in_(product_ids)))
+        await session.execute(delete(CategoryModel).where(CategoryModel.id == category_id))
+        await session.execute(delete(UserModel).where(UserModel.id.in_(user_ids)))
+        await session.commit()
+
+
+async def _shopper(store: CartStore, user_id: int, product_ids: list[int],
+                   samples: dict[str, list[float]], deadline: float) -> None:
+    while time.perf_counter() < deadline:
+        product_id = random.choice(product_ids)
+        steps = (
+            ("add_item", lambda db: store.add_item(db, user_id, product_id, 1)),
+            ("get_cart", lambda db: store.get_cart(db, user_id)),
+            ("set_quantity", lambda db: store.set_quantity(db, user_id, product_id, 3)),
+            ("get_summary", lambda db: store.get_summary(db, user_id)),
+            ("remove_item", lambda db: store.remove_item(db, user_id, product_id)),
+        )
+        for name, step in steps:
+            async with timed(samples[name]):
+                async with async_session_maker() as db:
+                    await step(db)
+
+
+async def _measure(name: str, store: CartStore, user_ids: list[int], product_ids: list[int]) -> None:
+    samples = {operation: [] for operation in OPERATIONS}
+    deadline = time.perf_counter() + DURATION
+    await asyncio.gather(*(
+        _shopper(store, user_id, product_ids, samples, deadline) for user_id in user_ids
+    ))
+    print(f"--- {name}")
+    for operation in OPERATIONS:
+        print(summary(operation, samples[operation]))
+    if store.write_behind:
+        flushes: list[float] = []
+        async with timed(flushes):
+            await store.flush()
+        print(summary("flush", flushes))
+
+
+async def main() -> None:
+    async_engine.echo = False
+    user_ids, product_ids, category_id = await _create_fixtures()
+    buyer_ids = user_ids[1:]
+    try:
+        await _measure("sql", SqlCartStore(), buyer_ids, product_ids)
+        await _measure(f"kv ({CART_STORE_URL or 'local'})",
+                       KeyValueCartStore(create_cart_backend(CART_STORE_URL)), buyer_ids, product_ids)
+    finally:
+        await _drop_fixtures(user_ids, product_ids, category_id)
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,42 @@
+"""
+Общие помощники замеров: сбор латентностей и перцентили.
+"""
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+BASE_URL = os.getenv("BENCH_BASE_URL", "http://127.0.0.1:8000")
+
+
+def percentile(samples: list[float], p: float) -> float:
+    """
+    Перцентиль методом ближайшего ранга; для пустой выборки — nan.
+    """
+    if not samples:
+        return math.nan
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summary(name: str, samples: list[float]) -> str:
+    """
+    Строка отчёта: число замеров, p50/p99/max в миллисекундах.
+    """
+    return (f"{name:<28} n={len(samples):<6} "
+            f"p50={percentile(samples, 50) * 1000:8.2f}ms "
+            f"p99={percentile(samples, 99) * 1000:8.2f}ms "
+            f"max={(max(samples) if samples else math.nan) * 1000:8.2f}ms")
+
+
+@asynccontextmanager
+async def timed(samples: list[float]):
+    """
+    Добавляет в samples длительность блока в секундах.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        samples.append(time.perf_counter() - started)
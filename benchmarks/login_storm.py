@@ -0,0 +1,78 @@
+"""
+p99 «посторонних» эндпоинтов во время шквала логинов.
+
+Каждый логин — bcrypt в пуле PASSWORD_WORKERS потоков. Скрипт сначала меряет фон
+(GET / и GET /categories/) без нагрузки, затем то же самое, пока LOGIN_CONCURRENCY клиентов
+непрерывно дёргают POST /users/token. Если bcrypt блокирует event loop или съедает все
+соединения, p99 фоновых запросов вырастет на порядки; 503 от переполненной очереди
+считаются отдельно.
+
+    uvicorn app.main:app --workers 1 &
+    BENCH_BASE_URL=http://127.0.0.1:8000 python -m benchmarks.login_storm
+"""
+import asyncio
+import os
+import time
+import uuid
+
+import httpx
+
+from benchmarks.common import BASE_URL, summary, timed
+
+DURATION = float(os.getenv("BENCH_DURATION", "10"))
+LOGIN_CONCURRENCY = int(os.getenv("LOGIN_CONCURRENCY", "64"))
+PROBE_CONCURRENCY = int(os.getenv("PROBE_CONCURRENCY", "4"))
+PROBE_PATHS = ("/", "/categories/")
+
+
+async def _register(client: httpx.AsyncClient) -> tuple[str, str]:
+    email, password = f"bench-{uuid.uuid4().hex[:12]}@example.com", "bench-password"
+    response = await client.post("/users/", json={"email": email, "password": password})
+    response.raise_for_status()
+    return email, password
+
+
+async def _probe(client: httpx.AsyncClient, samples: dict[str, list[float]], deadline: float) -> None:
+    while time.perf_counter() < deadline:
+        for path in PROBE_PATHS:
+            async with timed(samples[path]):
+                (await client.get(path)).raise_for_status()
+
+
+async def _login(client: httpx.AsyncClient, email: str, password: str,
+                 samples: list[float], statuses: dict[int, int], deadline: float) -> None:
+    while time.perf_counter() < deadline:
+        async with timed(samples):
+            response = await client.post("/users/token", data={"username": email, "password": password})
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        if response.status_code == 503:
+            await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+
+
+async def _phase(client: httpx.AsyncClient, credentials: tuple[str, str] | None) -> None:
+    probes = {path: [] for path in PROBE_PATHS}
+    logins: list[float] = []
+    statuses: dict[int, int] = {}
+    deadline = time.perf_counter() + DURATION
+    tasks = [_probe(client, probes, deadline) for _ in range(PROBE_CONCURRENCY)]
+    if credentials:
+        tasks += [_login(client, *credentials, logins, statuses, deadline) for _ in range(LOGIN_CONCURRENCY)]
+    await asyncio.gather(*tasks)
+
+    print(f"--- {'login storm' if credentials else 'baseline'} ({DURATION:.0f}s)")
+    for path, samples in probes.items():
+        print(summary(f"GET {path}", samples))
+    if credentials:
+        print(summary("POST /users/token", logins), "statuses:", statuses)
+
+
+async def main() -> None:
+    limits = httpx.Limits(max_connections=LOGIN_CONCURRENCY + PROBE_CONCURRENCY)
+    async with httpx.AsyncClient(base_url=BASE_URL, limits=limits, timeout=60) as client:
+        credentials = await _register(client)
+        await _phase(client, None)
+        await _phase(client, credentials)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,132 @@
+"""
+Пропускная способность /media: MediaFiles против прежнего StaticFiles.
+
+Оба приложения раздают один и тот же каталог и запускаются отдельными процессами uvicorn,
+чтобы клиент не делил с сервером event loop. Сценарии: полный GET картинки, GET
+сжимаемого файла с Accept-Encoding (MediaFiles отдаёт предсжатую копию), повторный
+запрос с If-None-Match и Range-запрос.
+
+    python -m benchmarks.media_throughput
+
+BENCH_MEDIA_DIR — каталог с готовыми файлами; по умолчанию создаётся временный с
+синтетическими файлами.
+"""
+import asyncio
+import gzip
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI
+from fastapi.staticfiles import StaticFiles
+
+from app.media import MediaFiles
+from benchmarks.common import summary, timed
+
+DURATION = float(os.getenv("BENCH_DURATION", "10"))
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "32"))
+MEDIA_DIR = os.getenv("BENCH_MEDIA_DIR", "")
+
+IMAGE_NAME = "bench-image.jpg"
+TEXT_NAME = "bench-data.json"
+
+
+def _build_app(files_class: type[StaticFiles]) -> FastAPI:
+    application = FastAPI()
+    application.mount("/media", files_class(directory=os.environ["BENCH_MEDIA_DIR"]), name="media")
+    return application
+
+
+def media_app() -> FastAPI:
+    return _build_app(MediaFiles)
+
+
+def static_app() -> FastAPI:
+    return _build_app(StaticFiles)
+
+
+def _prepare_media(directory: Path) -> None:
+    (directory / IMAGE_NAME).write_bytes(os.urandom(512 * 1024))
+    data = b'{"id": 1, "name": "product", "description": "' + b"lorem ipsum " * 20_000 + b'"}'
+    (directory / TEXT_NAME).write_bytes(data)
+    (directory / f"{TEXT_NAME}.gz").write_bytes(gzip.compress(data, compresslevel=9))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_ready(client: httpx.AsyncClient) -> None:
+    for _ in range(100):
+        try:
+            await client.get(f"/media/{IMAGE_NAME}")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("uvicorn did not start")
+
+
+async def _worker(client: httpx.AsyncClient, headers: dict, path: str,
+                  samples: list[float], sizes: list[int], deadline: float) -> None:
+    while time.perf_counter() < deadline:
+        async with timed(samples):
+            response = await client.get(path, headers=headers)
+        sizes.append(response.num_bytes_downloaded)  # байты по сети, до распаковки
+
+
+async def _scenario(client: httpx.AsyncClient, name: str, path: str, headers: dict) -> None:
+    samples: list[float] = []
+    sizes: list[int] = []
+    started = time.perf_counter()
+    deadline = started + DURATION
+    await asyncio.gather(*(
+        _worker(client, headers, path, samples, sizes, deadline) for _ in range(CONCURRENCY)
+    ))
+    elapsed = time.perf_counter() - started
+    print(summary(name, samples),
+          f"{len(samples) / elapsed:8.0f} req/s {sum(sizes) / elapsed / 2 ** 20:8.1f} MiB/s")
+
+
+async def _run(factory: str, media_dir: str) -> None:
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"benchmarks.media_throughput:{factory}", "--factory",
+         "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        env={**os.environ, "BENCH_MEDIA_DIR": media_dir},
+    )
+    try:
+        limits = httpx.Limits(max_connections=CONCURRENCY)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as client:
+            await _wait_ready(client)
+            etag = (await client.get(f"/media/{IMAGE_NAME}")).headers["etag"]
+            print(f"--- {factory}")
+            await _scenario(client, "GET image", f"/media/{IMAGE_NAME}", {})
+            await _scenario(client, "GET json, gzip accepted", f"/media/{TEXT_NAME}",
+                            {"accept-encoding": "gzip"})
+            await _scenario(client, "GET image, If-None-Match", f"/media/{IMAGE_NAME}",
+                            {"if-none-match": etag})
+            await _scenario(client, "GET image, Range 64 KiB", f"/media/{IMAGE_NAME}",
+                            {"range": "bytes=0-65535"})
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def main() -> None:
+    with tempfile.TemporaryDirectory() as generated:
+        media_dir = MEDIA_DIR or generated
+        if not MEDIA_DIR:
+            _prepare_media(Path(generated))
+        for factory in ("static_app", "media_app"):
+            await _run(factory, media_dir)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+"""
+Задержка event loop во время параллельных загрузок изображений.
+
+Сервер (отдельный процесс uvicorn) принимает файлы тем же путём, что и POST /products/ —
+save_product_image: multipart, копирование кусками через пул потоков, генерация вариантов
+в пуле процессов. Внутри сервера работает проба: sleep(LAG_INTERVAL) и замер, насколько
+позже он проснулся. Сначала снимается фон без нагрузки, затем лаг под UPLOAD_CONCURRENCY
+параллельными загрузками. Лаг в десятки миллисекунд — признак блокирующего вызова в loop.
+
+    python -m benchmarks.upload_loop_lag
+
+Загруженные файлы и их варианты удаляются после замера. Отметку о готовности вариантов
+в БД сервер записать не сможет, если база недоступна, — на замер это не влияет.
+"""
+import asyncio
+import io
+import os
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager, suppress
+
+import httpx
+from fastapi import FastAPI, File, UploadFile
+
+from app.images import MEDIA_ROOT, has_all_variants, shutdown_image_workers, variant_paths
+from app.routers.products import save_product_image
+from benchmarks.common import summary, timed
+from benchmarks.media_throughput import _free_port
+
+DURATION = float(os.getenv("BENCH_DURATION", "10"))
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "16"))
+LAG_INTERVAL = 0.01
+
+
+def lag_app() -> FastAPI:
+    lags: list[float] = []
+
+    async def probe() -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            lags.append(loop.time() - started - LAG_INTERVAL)
+
+    @asynccontextmanager
+    async def lifespan(_app: FastAPI):
+        task = asyncio.create_task(probe())
+        yield
+        task.cancel()
+        shutdown_image_workers()
+
+    application = FastAPI(lifespan=lifespan)
+
+    @application.post("/upload")
+    async def upload(image: UploadFile = File(...)) -> dict:
+        return {"url": await save_product_image(image)}
+
+    @application.get("/lag")
+    async def lag() -> list[float]:
+        samples = lags[:]
+        lags.clear()
+        return samples
+
+    return application
+
+
+def _sample_jpeg() -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.effect_noise((1600, 1200), 64).convert("RGB").save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+async def _uploader(client: httpx.AsyncClient, image: bytes, samples: list[float],
+                    urls: list[str], deadline: float) -> None:
+    while time.perf_counter() < deadline:
+        # Хвост после маркера конца JPEG не мешает декодеру, но делает хеш (и имя файла) уникальным
+        body = image + os.urandom(16)
+        async with timed(samples):
+            response = await client.post("/upload", files={"image": ("bench.jpg", body, "image/jpeg")})
+        response.raise_for_status()
+        urls.append(response.json()["url"])
+
+
+def _wait_variants(urls: list[str], timeout: float = 120) -> None:
+    # Пул процессов доделывает начатые задачи и после остановки сервера — дожидаемся их,
+    # иначе варианты появятся уже после очистки
+    deadline = time.monotonic() + timeout
+    pending = [url.rsplit("/", 1)[-1] for url in urls]
+    while pending and time.monotonic() < deadline:
+        pending = [name for name in pending if not has_all_variants(name)]
+        time.sleep(0.2)
+
+
+def _cleanup(urls: list[str]) -> None:
+    for url in urls:
+        file_name = url.rsplit("/", 1)[-1]
+        for path in (MEDIA_ROOT / file_name, *variant_paths(file_name)):
+            path.unlink(missing_ok=True)
+
+
+async def main() -> None:
+    image = _sample_jpeg()
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.upload_loop_lag:lag_app", "--factory",
+         "--port", str(port), "--log-level", "warning", "--no-access-log"],
+    )
+    urls: list[str] = []
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            for _ in range(100):
+                with suppress(httpx.TransportError):
+                    await client.get("/lag")
+                    break
+                await asyncio.sleep(0.1)
+
+            await asyncio.sleep(DURATION)
+            print(summary("loop lag, idle", (await client.get("/lag")).json()))
+
+            uploads: list[float] = []
+            deadline = time.perf_counter() + DURATION
+            await asyncio.gather(*(
+                _uploader(client, image, uploads, urls, deadline) for _ in range(UPLOAD_CONCURRENCY)
+            ))
+            print(summary("loop lag, uploading", (await client.get("/lag")).json()))
+            print(summary(f"upload {len(image) // 1024} KiB", uploads))
+            await asyncio.to_thread(_wait_variants, urls)
+    finally:
+        server.terminate()
+        server.wait()
+        _cleanup(urls)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,12 @@
+from app.database import QUERY_COUNT_HEADER
+
+
+def assert_max_queries(response, max_queries: int) -> None:
+    """
+    Проверяет по заголовку ответа, что эндпоинт уложился в бюджет SQL-запросов.
+    """
+    count = int(response.headers[QUERY_COUNT_HEADER])
+    assert count <= max_queries, (
+        f"{response.request.method} {response.request.url.path}: "
+        f"{count} SQL queries, budget is {max_queries}"
+    )
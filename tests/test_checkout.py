@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+
+from app.auth import create_access_token
+from app.models.cart_items import CartItem as CartItemModel
+from app.models.orders import Order as OrderModel
+from app.models.products import Product as ProductModel
+from app.models.users import User as UserModel
+
+pytestmark = pytest.mark.anyio
+
+
+async def _fill_cart(db, buyer, product, quantity):
+    db.add(CartItemModel(user_id=buyer.id, product_id=product.id, quantity=quantity))
+    await db.commit()
+
+
+async def test_concurrent_checkouts_of_one_cart_create_one_order(client, db, buyer, auth_headers, product):
+    await _fill_cart(db, buyer, product, 3)
+
+    responses = await asyncio.gather(*(
+        client.post("/orders/checkout", headers=auth_headers) for _ in range(5)
+    ))
+
+    assert sorted(response.status_code for response in responses) == [201, 400, 400, 400, 400]
+    assert await db.scalar(select(func.count(OrderModel.id))) == 1
+    assert await db.scalar(select(ProductModel.stock).where(ProductModel.id == product.id)) == 7
+
+
+async def test_concurrent_checkouts_never_oversell(client, db, product):
+    buyers = [UserModel(email=f"buyer{i}@example.com", hashed_password="-", role="buyer") for i in range(8)]
+    db.add_all(buyers)
+    await db.flush()
+    db.add_all(CartItemModel(user_id=buyer.id, product_id=product.id, quantity=3) for buyer in buyers)
+    await db.commit()
+
+    responses = await asyncio.gather(*(
+        client.post("/orders/checkout", headers={
+            "Authorization": f"Bearer {create_access_token({'sub': buyer.email, 'id': buyer.id})}"
+        })
+        for buyer in buyers
+    ))
+
+    # 10 штук на складе: успешно оформить можно только 3 заказа по 3 штуки
+    assert sum(response.status_code == 201 for response in responses) == 3
+    assert await db.scalar(select(ProductModel.stock).where(ProductModel.id == product.id)) == 1
@@ -0,0 +1,33 @@
+import pytest
+
+from app.cache import product_cache
+from tests.query_budget import assert_max_queries
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_add_item_to_cart_query_budget(client, auth_headers, product):
+    # Пользователь по токену и одна вставка с проверкой товара — для новой и для существующей позиции
+    for _ in range(2):
+        response = await client.post(
+            "/cart/items", json={"product_id": product.id, "quantity": 1}, headers=auth_headers
+        )
+        assert response.status_code == 201
+        assert_max_queries(response, 2)
+    assert response.json()["quantity"] == 2
+
+
+async def test_get_product_query_budget(client, product):
+    await product_cache.invalidate(product.id)  # id повторяются между тестами
+
+    response = await client.get(f"/products/{product.id}")
+    assert response.status_code == 200
+    assert_max_queries(response, 1)
+
+    cached = await client.get(f"/products/{product.id}")
+    assert cached.json() == response.json()
+    assert_max_queries(cached, 0)
+
+    not_modified = await client.get(f"/products/{product.id}", headers={"If-None-Match": response.headers["ETag"]})
+    assert not_modified.status_code == 304
+    assert_max_queries(not_modified, 0)